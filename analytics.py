@@ -0,0 +1,176 @@
+"""Аналитика по истории расписаний: матрица пользователи × дни на NumPy.
+
+numpy и matplotlib — необязательные зависимости: без них команда /analytics
+сообщает, что аналитика недоступна, а без matplotlib отдаёт только текст.
+"""
+import html
+import io
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    # Без pyplot: его глобальное состояние не потокобезопасно, а график
+    # строится в отдельном потоке
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+except ImportError:
+    Figure = None
+
+from schedule import OFFICE, STATUSES, STATUS_CODES, WEEKEND, day_index
+
+REMOTE = STATUS_CODES["Дистанционно"]
+TRIP = STATUS_CODES["Командировка"]
+# Дни, в которые сотрудник работает (а не отдыхает или болеет)
+WORKING = (OFFICE, REMOTE, TRIP)
+DAY_NAMES = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+CODES = len(STATUSES) + 1
+
+
+def available() -> bool:
+    return np is not None
+
+
+@dataclass
+class Report:
+    start: date
+    days: int
+    users: List[int]
+    daily_office: "np.ndarray"       # доля сотрудников в офисе по дням
+    weekday_shares: "np.ndarray"     # 7 × CODES: доля статусов по дням недели
+    user_counts: "np.ndarray"        # пользователи × CODES: число дней в каждом статусе
+
+
+def build_matrix(
+    users: Sequence[int],
+    start: date,
+    days: int,
+    templates: Dict[int, bytes],
+    overrides: Iterable[Tuple[int, str, str]],
+) -> "np.ndarray":
+    """Статусы пользователей по дням: значение по умолчанию, затем шаблон, затем явные изменения."""
+    start_index = day_index(start)
+    weekdays = (start_index + np.arange(days)) % 7
+    defaults = np.where(weekdays >= 5, WEEKEND, OFFICE).astype(np.uint8)
+    matrix = np.repeat(defaults[np.newaxis, :], len(users), axis=0)
+
+    rows = {uid: row for row, uid in enumerate(users)}
+    for uid, template in templates.items():
+        row = rows.get(uid)
+        if row is not None:
+            codes = np.frombuffer(template, dtype=np.uint8)[weekdays]
+            mask = codes > 0
+            matrix[row, mask] = codes[mask]
+
+    row_ids, columns, codes = [], [], []
+    for uid, day_str, status in overrides:
+        row = rows.get(uid)
+        code = STATUS_CODES.get(status)
+        column = (date.fromisoformat(day_str) - start).days
+        if row is not None and code and 0 <= column < days:
+            row_ids.append(row)
+            columns.append(column)
+            codes.append(code)
+    if row_ids:
+        matrix[np.array(row_ids), np.array(columns)] = np.array(codes, dtype=np.uint8)
+    return matrix
+
+
+def analyze(matrix: "np.ndarray", users: Sequence[int], start: date) -> Report:
+    count, days = matrix.shape
+    weekdays = (day_index(start) + np.arange(days)) % 7
+
+    daily_office = (matrix == OFFICE).sum(axis=0) / max(count, 1)
+
+    # Пары (день недели, статус) считаются одним bincount по составному индексу
+    keys = weekdays[np.newaxis, :] * CODES + matrix
+    weekday_counts = np.bincount(keys.ravel(), minlength=7 * CODES).reshape(7, CODES).astype(float)
+    totals = weekday_counts.sum(axis=1, keepdims=True)
+    weekday_shares = np.divide(weekday_counts, totals, out=np.zeros_like(weekday_counts), where=totals > 0)
+
+    user_keys = np.arange(count)[:, np.newaxis] * CODES + matrix
+    user_counts = np.bincount(user_keys.ravel(), minlength=count * CODES).reshape(count, CODES)
+    return Report(start, days, list(users), daily_office, weekday_shares, user_counts)
+
+
+def top_users(report: Report, code: int, limit: int = 5) -> List[Tuple[int, float]]:
+    """Пользователи с наибольшей долей статуса code среди рабочих дней."""
+    working = report.user_counts[:, list(WORKING)].sum(axis=1)
+    share = np.divide(
+        report.user_counts[:, code], working, out=np.zeros(len(working)), where=working > 0
+    )
+    order = np.argsort(-share, kind="stable")[:limit]
+    return [(report.users[i], float(share[i])) for i in order if share[i] > 0]
+
+
+def summary(report: Report, names: Dict[int, str]) -> str:
+    end = report.start + timedelta(days=report.days - 1)
+    weekdays = (day_index(report.start) + np.arange(report.days)) % 7
+    workdays = weekdays < 5
+    average = float(report.daily_office[workdays].mean()) if workdays.any() else 0.0
+
+    lines = [
+        f"<b>📊 Аналитика {report.start.strftime('%d.%m.%Y')} – {end.strftime('%d.%m.%Y')}</b>",
+        f"Сотрудников: {len(report.users)}, дней: {report.days}",
+        f"Средняя загрузка офиса в будни: {average:.0%}\n",
+        "<b>По дням недели</b> (🏢 офис / 🏠 дистанционно / ✈️ командировка):",
+    ]
+    for weekday in range(5):
+        shares = report.weekday_shares[weekday]
+        lines.append(
+            f"{DAY_NAMES[weekday]}: 🏢 {shares[OFFICE]:.0%} / 🏠 {shares[REMOTE]:.0%} / ✈️ {shares[TRIP]:.0%}"
+        )
+    for title, code in (("Чаще всего дистанционно", REMOTE), ("Чаще всего в офисе", OFFICE)):
+        top = top_users(report, code)
+        if top:
+            lines.append(f"\n<b>{title}:</b>")
+            lines.extend(f"{html.escape(str(names.get(uid, uid)))} — {share:.0%}" for uid, share in top)
+    return "\n".join(lines)
+
+
+def render_chart(report: Report) -> Optional[bytes]:
+    if Figure is None:
+        return None
+    figure = Figure(figsize=(9, 7))
+    FigureCanvasAgg(figure)
+    daily, weekly = figure.subplots(2, 1)
+    # Выходные не показываем, иначе график проваливается в ноль каждую неделю
+    workdays = np.flatnonzero((day_index(report.start) + np.arange(report.days)) % 7 < 5)
+    dates = [report.start + timedelta(days=int(i)) for i in workdays]
+    daily.plot(dates, report.daily_office[workdays] * 100, color="tab:blue", marker=".")
+    daily.set_title("Загрузка офиса в будни, %")
+    daily.set_ylim(0, 100)
+    daily.grid(alpha=0.3)
+    daily.tick_params(axis="x", labelrotation=30)
+
+    bottom = np.zeros(7)
+    for code in (OFFICE, REMOTE, TRIP, STATUS_CODES["Отпуск"], STATUS_CODES["Больничный"], WEEKEND):
+        values = report.weekday_shares[:, code] * 100
+        weekly.bar(DAY_NAMES, values, bottom=bottom, label=STATUSES[code - 1])
+        bottom += values
+    weekly.set_title("Статусы по дням недели, %")
+    weekly.legend(loc="upper left", bbox_to_anchor=(1, 1), fontsize=8)
+
+    figure.tight_layout()
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format="png", dpi=100)
+    return buffer.getvalue()
+
+
+def run_report(
+    users: Sequence[int],
+    start: date,
+    days: int,
+    templates: Dict[int, bytes],
+    overrides: Iterable[Tuple[int, str, str]],
+    names: Dict[int, str],
+) -> Tuple[str, Optional[bytes]]:
+    """Полный расчёт для команды: текст и PNG. Выполняется вне event loop."""
+    matrix = build_matrix(users, start, days, templates, overrides)
+    report = analyze(matrix, users, start)
+    return summary(report, names), render_chart(report)
@@ -0,0 +1,166 @@
+"""Нагрузочный тест бота без Telegram.
+
+Синтетические обновления (/start, просмотр расписания, серии переключений,
+общее расписание у админов) подаются напрямую в dp.feed_update, а Bot API
+заменён FakeSession с настраиваемой задержкой.
+
+    python benchmark.py --users 500 --save baseline.json
+    python benchmark.py --users 500 --compare baseline.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import time
+import tracemalloc
+from datetime import date, timedelta
+from typing import Any, Dict, List
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота расписаний")
+    parser.add_argument("--users", type=int, default=200, help="число сотрудников")
+    parser.add_argument("--admins", type=int, default=5, help="сколько из них админов")
+    parser.add_argument("--toggles", type=int, default=5, help="нажатий в одной серии переключений")
+    parser.add_argument("--rounds", type=int, default=3, help="сколько раз повторить сценарий")
+    parser.add_argument("--concurrency", type=int, default=50, help="обновлений, обрабатываемых одновременно")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа Bot API, с")
+    parser.add_argument("--telegram-limits", action="store_true", help="не отключать ограничения скорости отправки")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="считать прирост памяти через tracemalloc (заметно замедляет прогон)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="сохранить результат в JSON")
+    parser.add_argument("--compare", help="сравнить с сохранённым результатом")
+    return parser.parse_args()
+
+
+def configure_environment(args: argparse.Namespace):
+    # Окружение должно быть готово до импорта main
+    os.environ["STORAGE_BACKEND"] = "memory"
+    os.environ["EDIT_DEBOUNCE"] = "0.05"
+    os.environ["ADMINS"] = ",".join(str(uid) for uid in range(1, args.admins + 1))
+    if not args.telegram_limits:
+        os.environ["OUTBOUND_GLOBAL_RATE"] = "1000000"
+        os.environ["OUTBOUND_CHAT_RATE"] = "1000000"
+        os.environ["FLOOD_MESSAGE_RATE"] = "1000000"
+        os.environ["FLOOD_CALLBACK_RATE"] = "1000000"
+    logging.disable(logging.INFO)
+
+
+def build_scenario(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    from fake_telegram import callback_update, message_update
+
+    rng = random.Random(args.seed)
+    update_ids = iter(range(1, 10 ** 9))
+    today = date.today()
+    users = range(1, args.users + 1)
+    updates = [message_update(next(update_ids), uid, "/start") for uid in users]
+
+    for _ in range(args.rounds):
+        batch = []
+        for uid in users:
+            batch.append(message_update(next(update_ids), uid, "🧑‍💼 Мое расписание"))
+            day = today + timedelta(days=rng.randrange(10))
+            action = "toggle_weekend" if day.weekday() >= 5 else "toggle"
+            message_id = rng.randrange(1, 10 ** 6)
+            for _ in range(args.toggles):
+                batch.append(callback_update(next(update_ids), uid, f"{action}:{day.isoformat()}:0", message_id))
+        for uid in range(1, args.admins + 1):
+            batch.append(callback_update(next(update_ids), uid, "general_schedule"))
+            batch.append(callback_update(next(update_ids), uid, "occupancy"))
+        rng.shuffle(batch)
+        updates.extend(batch)
+    return updates
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    import main
+    from aiogram.types import Update
+    from fake_telegram import FakeSession
+
+    session = FakeSession(latency=args.latency)
+    session.middleware = main.bot.session.middleware
+    main.bot.session = session
+
+    raw_updates = build_scenario(args)
+    updates = [Update.model_validate(raw, context={"bot": main.bot}) for raw in raw_updates]
+    latencies: List[float] = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def feed(update: Update):
+        async with semaphore:
+            started = time.perf_counter()
+            await main.dp.feed_update(main.bot, update)
+            latencies.append(time.perf_counter() - started)
+
+    main.storage.start()
+    main.outbound.start()
+    if args.trace_memory:
+        tracemalloc.start()
+    memory_before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    await asyncio.gather(*(feed(update) for update in updates))
+    elapsed = time.perf_counter() - started
+    await main.edits.drain(timeout=30)
+    await main.outbound.drain(timeout=30)
+    memory_after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    await main.outbound.close()
+    await main.storage.close()
+
+    result = {
+        "updates": len(updates),
+        "seconds": round(elapsed, 3),
+        "updates_per_sec": round(len(updates) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "api_calls": len(session.calls),
+        "api_calls_per_update": round(len(session.calls) / len(updates), 3),
+        "edits_requested": main.edits.requested,
+        "edits_pushed": main.edits.pushed,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    if args.trace_memory:
+        result["memory_growth_kb"] = round((memory_after - memory_before) / 1024, 1)
+    return result
+
+
+def report(result: Dict[str, Any], baseline: Dict[str, Any] = None):
+    for key, value in result.items():
+        line = f"{key:>22}: {value}"
+        if baseline and isinstance(baseline.get(key), (int, float)) and baseline[key]:
+            change = (value - baseline[key]) / baseline[key] * 100
+            line += f"   (база {baseline[key]}, {change:+.1f}%)"
+        print(line)
+
+
+def main_cli():
+    args = parse_args()
+    configure_environment(args)
+    result = asyncio.run(run(args))
+    result["params"] = {
+        "users": args.users, "admins": args.admins, "toggles": args.toggles,
+        "rounds": args.rounds, "concurrency": args.concurrency, "latency": args.latency,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("params") != result["params"]:
+            print("⚠️ Параметры отличаются от базового прогона, сравнение неточное")
+    report({k: v for k, v in result.items() if k != "params"}, baseline)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
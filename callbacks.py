@@ -0,0 +1,84 @@
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.types import CallbackQuery
+
+from logging_setup import handler_var
+from metrics import HANDLER_ERRORS, HANDLER_LATENCY
+
+logger = logging.getLogger(__name__)
+
+SEPARATOR = ":"
+MAX_CALLBACK_DATA = 64  # ограничение Telegram на callback_data, в байтах
+
+
+class CallbackRouter:
+    """Кодек callback_data и таблица обработчиков по префиксу.
+
+    Данные кнопки имеют вид "action:arg1:arg2". Строка разбирается один раз,
+    обработчик ищется в словаре по action, а аргументы передаются ему
+    именованными параметрами в порядке, объявленном при регистрации.
+    Действия с admin=True проверяются is_admin до вызова обработчика:
+    callback_data присылает клиент, и её можно подделать.
+    """
+
+    def __init__(self, is_admin: Callable[[int], bool] = lambda user_id: False):
+        self.is_admin = is_admin
+        self._routes: Dict[str, Tuple[CallableObject, Tuple[str, ...], bool]] = {}
+
+    def route(self, action: str, *fields: str, admin: bool = False) -> Callable:
+        if SEPARATOR in action:
+            raise ValueError(f"Недопустимое имя действия: {action}")
+        if action in self._routes:
+            raise ValueError(f"Действие {action} уже зарегистрировано")
+
+        def decorator(handler: Callable) -> Callable:
+            self._routes[action] = (CallableObject(handler), fields, admin)
+            return handler
+
+        return decorator
+
+    @staticmethod
+    def encode(action: str, *args: Any) -> str:
+        data = SEPARATOR.join([action, *map(str, args)])
+        if len(data.encode()) > MAX_CALLBACK_DATA:
+            raise ValueError(f"callback_data длиннее {MAX_CALLBACK_DATA} байт: {data}")
+        return data
+
+    @staticmethod
+    def decode(data: str) -> Tuple[str, List[str]]:
+        action, *args = data.split(SEPARATOR)
+        return action, args
+
+    def resolve(self, data: str) -> Tuple[Optional[CallableObject], Dict[str, str], bool]:
+        action, args = self.decode(data)
+        route = self._routes.get(action)
+        if route is None:
+            return None, {}, False
+        handler, fields, admin = route
+        if len(args) != len(fields):
+            return None, {}, False
+        return handler, dict(zip(fields, args)), admin
+
+    async def dispatch(self, callback: CallbackQuery, **data: Any) -> Any:
+        handler, args, admin = self.resolve(callback.data or "")
+        if handler is None:
+            logger.warning(f"Неизвестная кнопка: {callback.data!r}")
+            await callback.answer("Кнопка устарела, откройте меню заново", show_alert=True)
+            return None
+        if admin and not self.is_admin(callback.from_user.id):
+            logger.warning(f"Пользователь {callback.from_user.id} без прав нажал {callback.data!r}")
+            await callback.answer("⛔ Нет доступа", show_alert=True)
+            return None
+        name = handler.callback.__name__
+        handler_var.set(name)
+        started = time.perf_counter()
+        try:
+            return await handler.call(callback, **data, **args)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, name)
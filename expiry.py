@@ -0,0 +1,43 @@
+from heapq import heappop, heappush
+from typing import Dict, Hashable, Iterator, List, Set, Tuple
+
+
+class ExpiryIndex:
+    """Данные, сгруппированные по дням: день -> ключи записей этого дня.
+
+    Очередь дней хранится в куче, поэтому при смене дня удаляются ровно те
+    корзины, которые стали прошлыми, без обхода всех пользователей.
+    """
+
+    def __init__(self):
+        self._buckets: Dict[int, Set[Hashable]] = {}
+        self._days: List[int] = []
+
+    def add(self, index: int, key: Hashable):
+        bucket = self._buckets.get(index)
+        if bucket is None:
+            bucket = self._buckets[index] = set()
+            heappush(self._days, index)
+        bucket.add(key)
+
+    def discard(self, index: int, key: Hashable):
+        bucket = self._buckets.get(index)
+        if bucket is not None:
+            bucket.discard(key)
+            if not bucket:
+                # Запись в куче остаётся и будет пропущена при извлечении
+                del self._buckets[index]
+
+    def get(self, index: int) -> Set[Hashable]:
+        """Ключи дня index. Не изменять снаружи."""
+        return self._buckets.get(index, set())
+
+    def pop_before(self, index: int) -> Iterator[Tuple[int, Set[Hashable]]]:
+        while self._days and self._days[0] < index:
+            day = heappop(self._days)
+            bucket = self._buckets.pop(day, None)
+            if bucket:
+                yield day, bucket
+
+    def __len__(self) -> int:
+        return sum(len(bucket) for bucket in self._buckets.values())
@@ -0,0 +1,51 @@
+"""Выгрузка расписаний в CSV и XLSX.
+
+Строки берутся из генератора и сразу пишутся в буфер порциями, без сборки
+всей таблицы в памяти. openpyxl — необязательная зависимость для XLSX.
+"""
+import csv
+import io
+from typing import Iterable, Iterator, Optional, Sequence
+
+try:
+    from openpyxl import Workbook
+except ImportError:
+    Workbook = None
+
+CSV_CHUNK_ROWS = 200
+
+
+def xlsx_available() -> bool:
+    return Workbook is not None
+
+
+def csv_chunks(rows: Iterable[Sequence], chunk_rows: int = CSV_CHUNK_ROWS) -> Iterator[bytes]:
+    """CSV по частям: каждые chunk_rows строк отдаются готовыми байтами."""
+    text = io.StringIO()
+    writer = csv.writer(text)
+    # BOM, чтобы Excel сразу открыл файл в UTF-8
+    pending = "\ufeff"
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % chunk_rows == 0:
+            yield (pending + text.getvalue()).encode("utf-8")
+            pending = ""
+            text.seek(0)
+            text.truncate()
+    if pending or text.tell():
+        yield (pending + text.getvalue()).encode("utf-8")
+
+
+def write_xlsx(rows: Iterable[Sequence], title: str = "Расписание") -> Optional[bytes]:
+    if Workbook is None:
+        return None
+    # write_only: строки не хранятся в объектной модели книги
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title)
+    for row in rows:
+        sheet.append(list(row))
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
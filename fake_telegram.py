@@ -0,0 +1,148 @@
+"""Локальная замена Telegram Bot API для проверки бота без сети.
+
+Запуск как скрипт проверяет webhook-режим целиком: поднимает веб-сервер
+бота, отправляет на webhook несколько обновлений и печатает вызовы API,
+которые бот сделал в ответ.
+"""
+import asyncio
+import itertools
+import json
+import os
+import time
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+
+FAKE_BOT_ID = 42
+
+
+class FakeSession(BaseSession):
+    """Сессия, которая вместо HTTP-запросов записывает вызовы и отвечает сама."""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls: List[TelegramMethod] = []
+        self._message_ids = itertools.count(1000)
+
+    async def close(self):
+        pass
+
+    async def make_request(
+        self, bot: Bot, method: TelegramMethod[TelegramType], timeout: Optional[int] = None
+    ) -> TelegramType:
+        self.calls.append(method)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        result = self._result_for(method)
+        response = self.check_response(
+            bot=bot, method=method, status_code=200, content=json.dumps({"ok": True, "result": result})
+        )
+        return response.result
+
+    async def stream_content(
+        self, url: str, headers: Optional[Dict[str, Any]] = None, timeout: int = 30,
+        chunk_size: int = 65536, raise_for_status: bool = True
+    ) -> AsyncGenerator[bytes, None]:
+        yield b""
+
+    def _result_for(self, method: TelegramMethod) -> Any:
+        name = method.__api_method__
+        if name == "getMe":
+            return {"id": FAKE_BOT_ID, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+        if name == "getUpdates":
+            return []
+        if name == "getWebhookInfo":
+            return {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        if name.startswith("send") or name in ("editMessageText", "editMessageReplyMarkup"):
+            chat_id = getattr(method, "chat_id", None) or 0
+            message = {
+                "message_id": getattr(method, "message_id", None) or next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+            }
+            text = getattr(method, "text", None)
+            if text is not None:
+                message["text"] = text
+            return message
+        return True
+
+    def count(self, api_method: str) -> int:
+        return sum(1 for call in self.calls if call.__api_method__ == api_method)
+
+
+def _user(user_id: int) -> Dict[str, Any]:
+    return {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"}
+
+
+def message_update(update_id: int, user_id: int, text: str) -> Dict[str, Any]:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": _user(user_id),
+            "text": text,
+        },
+    }
+
+
+def callback_update(update_id: int, user_id: int, data: str, message_id: int = 1) -> Dict[str, Any]:
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": _user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": FAKE_BOT_ID, "is_bot": True, "first_name": "Fake"},
+                "text": "📅 Ваше расписание на 10 дней:",
+            },
+        },
+    }
+
+
+async def check_webhook():
+    import aiohttp
+    import main
+
+    session = FakeSession()
+    session.middleware = main.bot.session.middleware
+    main.bot.session = session
+    runner = await main.run_web(main.create_web_app(use_webhook=True))
+    url = f"http://127.0.0.1:{main.WEB_PORT}{main.WEBHOOK_PATH}"
+    updates = [
+        message_update(1, 1001, "/start"),
+        message_update(2, 1001, "🧑‍💼 Мое расписание"),
+    ]
+    try:
+        async with aiohttp.ClientSession() as client:
+            async with client.post(url, json=updates[0]) as response:
+                assert response.status == 401, "webhook принял запрос без секрета"
+            for update in updates:
+                headers = {"X-Telegram-Bot-Api-Secret-Token": main.WEBHOOK_SECRET}
+                async with client.post(url, json=update, headers=headers) as response:
+                    assert response.status == 200, await response.text()
+        await asyncio.sleep(0.2)
+    finally:
+        await runner.cleanup()
+
+    for call in session.calls:
+        print(call.__api_method__, getattr(call, "text", ""))
+    assert session.count("sendMessage") >= 2, "бот не ответил на обновления"
+    print("OK: webhook-режим обрабатывает обновления")
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("STORAGE_BACKEND", "memory")
+    os.environ.setdefault("WEBHOOK_URL", "http://127.0.0.1")
+    os.environ.setdefault("WEB_PORT", "18080")
+    asyncio.run(check_webhook())
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, Optional
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+logger = logging.getLogger(__name__)
+
+
+class HealthMonitor:
+    """Фоновая проверка состояния для /healthz и /readyz.
+
+    Каждая проба — функция, возвращающая число (задержку, возраст, размер
+    очереди). Для живости и готовности заданы свои пороги: превышение порога
+    живости означает, что процесс пора перезапустить, порога готовности —
+    что на экземпляр временно не стоит направлять трафик.
+    """
+
+    def __init__(
+        self,
+        probes: Dict[str, Callable[[], Optional[float]]],
+        liveness: Dict[str, float],
+        readiness: Dict[str, float],
+        interval: float = 5.0,
+    ):
+        self.probes = probes
+        self.liveness = liveness
+        self.readiness = readiness
+        self.interval = interval
+        self.draining = False
+        self._beats: Dict[str, float] = {}
+        self._started = time.monotonic()
+        # До первой проверки экземпляр жив, но трафик на него ещё не направляем
+        self.report: Dict[str, Any] = {"live": True, "ready": False, "checks": {}}
+
+    def beat(self, name: str):
+        self._beats[name] = time.monotonic()
+
+    def age(self, name: str) -> float:
+        """Секунды с последнего beat(name), а до первого — с запуска монитора."""
+        return time.monotonic() - self._beats.get(name, self._started)
+
+    def evaluate(self) -> Dict[str, Any]:
+        checks = {}
+        live = ready = True
+        for name, probe in self.probes.items():
+            try:
+                value = probe()
+            except Exception as e:
+                logger.warning(f"Проба {name} не выполнена: {e}")
+                value = None
+            if value is None:
+                continue
+            check = {"value": round(value, 3), "ok": True}
+            for kind, limits in (("live", self.liveness), ("ready", self.readiness)):
+                limit = limits.get(name)
+                if limit is not None:
+                    check[f"{kind}_limit"] = limit
+                    if value > limit:
+                        check["ok"] = False
+                        if kind == "live":
+                            live = False
+                        else:
+                            ready = False
+            checks[name] = check
+        return {"live": live, "ready": live and ready and not self.draining, "checks": checks}
+
+    def set_draining(self):
+        """Экземпляр останавливается: /readyz сразу перестаёт его рекомендовать."""
+        self.draining = True
+        self.report = self.evaluate()
+
+    async def run(self):
+        while True:
+            report = self.evaluate()
+            if report["ready"] != self.report["ready"]:
+                if report["ready"]:
+                    logger.info("Экземпляр готов принимать трафик")
+                else:
+                    failed = [name for name, check in report["checks"].items() if not check["ok"]]
+                    logger.warning(f"Экземпляр не готов, не прошли проверки: {failed}")
+            self.report = report
+            await asyncio.sleep(self.interval)
+
+
+class UpdatesProbeMiddleware(BaseRequestMiddleware):
+    """Отмечает каждый успешный getUpdates: polling жив, пока эти отметки идут."""
+
+    def __init__(self, monitor: HealthMonitor, beat: str = "updates"):
+        self.monitor = monitor
+        self.beat_name = beat
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        response = await make_request(bot, method)
+        if method.__api_method__ == "getUpdates":
+            self.monitor.beat(self.beat_name)
+        return response
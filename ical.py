@@ -0,0 +1,82 @@
+"""Формирование iCalendar (RFC 5545) для подписки в календарных приложениях."""
+from datetime import date, datetime, timedelta, timezone
+from typing import Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+PRODID = "-//DCL bot//Schedule//RU"
+
+
+class Event(NamedTuple):
+    uid: str
+    start: date
+    end: date  # не включительно, как DTEND у событий на весь день
+    summary: str
+    description: str = ""
+
+
+def escape(text: str) -> str:
+    return (
+        text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+    )
+
+
+def fold(line: str) -> str:
+    # Строки длиннее 75 байт переносятся с пробелом в начале продолжения
+    encoded = line.encode("utf-8")
+    if len(encoded) <= 75:
+        return line
+    parts = []
+    current = ""
+    size = 0
+    for char in line:
+        length = len(char.encode("utf-8"))
+        if size + length > (75 if not parts else 74):
+            parts.append(current)
+            current, size = "", 0
+        current += char
+        size += length
+    parts.append(current)
+    return "\r\n ".join(parts)
+
+
+def runs(days: Sequence[Tuple[date, Optional[str], str]]) -> Iterable[Tuple[date, date, str, List[str]]]:
+    """Склеивает подряд идущие дни с одинаковым статусом: (начало, конец, статус, комментарии).
+
+    days — (день, статус или None, комментарий) по порядку; None — день без события.
+    """
+    current = None
+    for day, status, comment in days:
+        if current is not None and status == current[2] and day == current[1]:
+            current[1] = day + timedelta(days=1)
+        else:
+            if current is not None and current[2] is not None:
+                yield tuple(current[:3]) + (current[3],)
+            current = [day, day + timedelta(days=1), status, []]
+        if comment:
+            current[3].append(f"{day.strftime('%d.%m')}: {comment}")
+    if current is not None and current[2] is not None:
+        yield tuple(current[:3]) + (current[3],)
+
+
+def render(name: str, events: Iterable[Event], stamp: Optional[datetime] = None) -> bytes:
+    stamp = (stamp or datetime.now(timezone.utc)).strftime("%Y%m%dT%H%M%SZ")
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        f"PRODID:{PRODID}",
+        "CALSCALE:GREGORIAN",
+        f"X-WR-CALNAME:{escape(name)}",
+    ]
+    for event in events:
+        lines.extend([
+            "BEGIN:VEVENT",
+            f"UID:{event.uid}",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART;VALUE=DATE:{event.start.strftime('%Y%m%d')}",
+            f"DTEND;VALUE=DATE:{event.end.strftime('%Y%m%d')}",
+            f"SUMMARY:{escape(event.summary)}",
+        ])
+        if event.description:
+            lines.append(f"DESCRIPTION:{escape(event.description)}")
+        lines.extend(["TRANSP:TRANSPARENT", "END:VEVENT"])
+    lines.append("END:VCALENDAR")
+    return ("\r\n".join(fold(line) for line in lines) + "\r\n").encode("utf-8")
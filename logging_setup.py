@@ -0,0 +1,97 @@
+import atexit
+import contextvars
+import json
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Контекст текущего обновления: попадает в каждую запись журнала
+update_id_var: contextvars.ContextVar = contextvars.ContextVar("update_id", default=None)
+user_id_var: contextvars.ContextVar = contextvars.ContextVar("user_id", default=None)
+handler_var: contextvars.ContextVar = contextvars.ContextVar("handler", default=None)
+
+
+class ContextFilter(logging.Filter):
+    """Копирует контекст обновления в запись. Работает в потоке, который пишет в журнал."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.update_id = update_id_var.get()
+        record.user_id = user_id_var.get()
+        record.handler = handler_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "update_id": getattr(record, "update_id", None),
+            "user_id": getattr(record, "user_id", None),
+            "handler": getattr(record, "handler", None),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class LogContextMiddleware(BaseMiddleware):
+    """Внешний middleware обновлений: запоминает update_id и пользователя для журнала."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        update_id_var.set(event.update_id)
+        user_id_var.set(user.id if user else None)
+        handler_var.set(None)
+        return await handler(event, data)
+
+
+def setup_logging(
+    path: str = "bot.log",
+    level: str = "INFO",
+    max_bytes: int = 10 * 1024 * 1024,
+    backups: int = 5,
+    rotate_when: str = "",
+    json_format: bool = False,
+) -> QueueListener:
+    """Записи ставятся в очередь, а в файл и консоль их пишет отдельный поток.
+
+    Файл ротируется по размеру или, если задан rotate_when (например "midnight"),
+    по времени.
+    """
+    if rotate_when:
+        file_handler = TimedRotatingFileHandler(path, when=rotate_when, backupCount=backups, encoding="utf-8")
+    else:
+        file_handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+    formatter = JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler(), file_handler]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.setLevel(level.upper())
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
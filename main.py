@@ -1,11 +1,20 @@
 import asyncio
+import hashlib
+import hmac
+import html
+import io
 import os
+import secrets
+import signal
 import logging
-from datetime import datetime, timedelta
-from typing import Set, Dict
+from contextlib import suppress
+from functools import lru_cache
+from datetime import date, datetime, timedelta
+from typing import Dict, Optional, Set, Tuple
 from aiohttp import web
 from aiogram import Bot, Dispatcher, F, Router
 from aiogram.types import (
+    BufferedInputFile,
     Message,
     KeyboardButton,
     ReplyKeyboardMarkup,
@@ -14,39 +23,182 @@ from aiogram.types import (
     CallbackQuery
 )
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command, CommandStart, BaseFilter
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
 from aiogram.client.default import DefaultBotProperties
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
 from dotenv import load_dotenv
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("bot.log")
-    ]
+import analytics
+import export
+import ical
+from callbacks import CallbackRouter
+from expiry import ExpiryIndex
+from flood import FloodControlMiddleware
+from health import HealthMonitor, UpdatesProbeMiddleware
+from lifecycle import InFlightMiddleware
+from logging_setup import LogContextMiddleware, setup_logging
+from metrics import (
+    EVENT_LOOP_LAG,
+    REGISTRY,
+    ApiMetricsMiddleware,
+    HandlerMetricsMiddleware,
+    UpdateLagMiddleware,
+    gauge,
+    watch_event_loop
 )
-logger = logging.getLogger(__name__)
+from outbound import EditCoalescer, OutboundDispatcher
+from picker import NameIndex, normalize, picker_keyboard
+from render_cache import RenderCache
+from schedule import ScheduleStore, STATUSES, STATUS_CODES, day_date, day_index, default_code, status_name
+from storage import FSMStorage, create_storage
 
 load_dotenv()
+
+# Настройка логирования: запись в файл идёт в отдельном потоке, не блокируя event loop
+log_listener = setup_logging(
+    path=os.getenv("LOG_FILE", "bot.log"),
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    max_bytes=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+    backups=int(os.getenv("LOG_BACKUPS", "5")),
+    rotate_when=os.getenv("LOG_ROTATE_WHEN", ""),
+    json_format=os.getenv("LOG_JSON", "0") == "1",
+)
+logger = logging.getLogger(__name__)
+
 TOKEN = os.getenv("BOT_TOKEN")
 
 ADMINS = set(map(int, os.getenv("ADMINS", "").split(','))) if os.getenv("ADMINS") else set()
 RESTRICTED_USERS: Set[int] = set()
 
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")
+STORAGE_PATH = os.getenv("STORAGE_PATH", "bot.db")
+STORAGE_FLUSH_INTERVAL = float(os.getenv("STORAGE_FLUSH_INTERVAL", "0.5"))
+# Сколько дней прошедшие статусы и комментарии хранятся в базе; в памяти — только с сегодняшнего дня
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "90"))
+# Если задан, устаревшие дни переносятся в этот файл SQLite, а не удаляются
+ARCHIVE_PATH = os.getenv("ARCHIVE_PATH", "")
+# Журнал изменений хранится дольше расписаний: кто и когда что поменял
+AUDIT_RETENTION_DAYS = int(os.getenv("AUDIT_RETENTION_DAYS", "365"))
+HISTORY_LIMIT = 20
+ANALYTICS_DAYS = 90
+# Дни старше RETENTION_DAYS удалены из базы и выглядели бы как статусы по умолчанию
+ANALYTICS_MAX_DAYS = min(366, RETENTION_DAYS)
+# Время ежедневной сводки для админов (ЧЧ:ММ); пустое значение отключает рассылку
+DIGEST_TIME = os.getenv("DIGEST_TIME", "09:00")
+DIGEST_COMMENT_LIMIT = 20
+ABSENT_STATUSES = ("Отпуск", "Больничный", "Командировка")
+EXPORT_MAX_DAYS = 366
+EXPORT_YIELD_ROWS = 20  # строк между передачами управления event loop
+# Токен для скачивания выгрузки по HTTP (Authorization: Bearer ...); без него маршрут отключён
+EXPORT_TOKEN = os.getenv("EXPORT_TOKEN", "")
+
+# Если WEBHOOK_URL не задан, бот получает обновления через polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEB_PORT = int(os.getenv("WEB_PORT", "8080"))
+# Сколько при остановке ждать обработки обновлений и отправки очередей
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "25"))
+# Подписка на календарь: ссылки подписываются ICAL_SECRET, без него маршруты отключены
+ICAL_SECRET = os.getenv("ICAL_SECRET", "")
+ICAL_DAYS = int(os.getenv("ICAL_DAYS", "90"))
+PUBLIC_URL = os.getenv("PUBLIC_URL", WEBHOOK_URL)
+# Версии данных живут в памяти, поэтому в ETag входит идентификатор запуска
+BOOT_ID = secrets.token_hex(4)
+
+TELEGRAM_TEXT_LIMIT = 4096
+GENERAL_PAGE_USERS = int(os.getenv("GENERAL_PAGE_USERS", "10"))
+GENERAL_HEADER_RESERVE = 64  # заголовок страницы со счётчиком
+GENERAL_COMMENT_LIMIT = 200
+GENERAL_NAME_LIMIT = 64
+# Список имён одного статуса в разбивке дня: все статусы вместе укладываются в одно сообщение
+OCCUPANCY_NAMES_LIMIT = (TELEGRAM_TEXT_LIMIT - 256) // len(STATUSES)
+# Блок сотрудника не длиннее этой доли страницы, поэтому страницы — это просто
+# срезы по GENERAL_PAGE_USERS человек и не требуют измерения всех блоков
+GENERAL_BLOCK_LIMIT = (TELEGRAM_TEXT_LIMIT - GENERAL_HEADER_RESERVE) // GENERAL_PAGE_USERS
+PICKER_PAGE_SIZE = int(os.getenv("PICKER_PAGE_SIZE", "8"))
+RANGE_MAX_DAYS = 366
+# Окно расписания: SCHEDULE_DAYS дней, листается по неделям на SCHEDULE_MAX_WEEKS вперёд
+SCHEDULE_DAYS = 10
+SCHEDULE_MAX_WEEKS = int(os.getenv("SCHEDULE_MAX_WEEKS", "26"))
+
 bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-dp = Dispatcher()
+# Данные в памяти — кэш, изменения уходят в хранилище пачками
+storage = create_storage(STORAGE_BACKEND, STORAGE_PATH, STORAGE_FLUSH_INTERVAL, ARCHIVE_PATH)
+fsm_storage = FSMStorage(storage)
+dp = Dispatcher(storage=fsm_storage)
+# Все запросы к Bot API проходят через общий ограничитель скорости
+outbound = OutboundDispatcher(
+    bot,
+    global_rate=float(os.getenv("OUTBOUND_GLOBAL_RATE", "30")),
+    chat_rate=float(os.getenv("OUTBOUND_CHAT_RATE", "1")),
+    queue_size=int(os.getenv("OUTBOUND_QUEUE_SIZE", "1000")),
+)
+bot.session.middleware(outbound)
+bot.session.middleware(ApiMetricsMiddleware())
+dp.update.outer_middleware(LogContextMiddleware())
+in_flight = InFlightMiddleware()
+dp.update.outer_middleware(in_flight)
+dp.message.outer_middleware(UpdateLagMiddleware())
+dp.message.middleware(HandlerMetricsMiddleware())
+# Серия быстрых нажатий на одну клавиатуру превращается в одну правку
+edits = EditCoalescer(bot, delay=float(os.getenv("EDIT_DEBOUNCE", "0.3")))
 router = Router()
 dp.include_router(router)
+callbacks = CallbackRouter(is_admin=lambda user_id: user_id in ADMINS)
 
 # Хранение данных
-user_work_modes: Dict[int, Dict[str, str]] = {}
+schedules = ScheduleStore()
 user_names: Dict[int, str] = {}
-awaiting_name_input: Set[int] = set()
-
 user_comments: Dict[int, Dict[str, str]] = {}  # {user_id: {date_str: comment}}
-awaiting_comment_input: Dict[int, str] = {}  # {user_id: date_str}
+comment_expiry = ExpiryIndex()  # день -> пользователи с комментарием на этот день
+name_index = NameIndex()
+
+render_cache = RenderCache(int(os.getenv("RENDER_CACHE_SIZE", "2048")))
+
+# Пробы состояния: превышение порога живости — повод перезапустить процесс,
+# порога готовности — временно не направлять на экземпляр трафик
+webhook_state: Dict[str, int] = {}
+health_monitor = HealthMonitor(
+    probes={
+        "event_loop_lag": EVENT_LOOP_LAG.get,
+        "updates_age": lambda: health_monitor.age("updates"),
+        "outbound_queue": lambda: outbound.queue_depth / outbound.queue_size,
+        "storage_flush_lag": lambda: storage.flush_lag,
+        "webhook_pending": lambda: webhook_state.get("pending"),
+    },
+    liveness={
+        "event_loop_lag": float(os.getenv("HEALTH_LOOP_LAG", "5")),
+        "updates_age": float(os.getenv("HEALTH_UPDATES_AGE", "180")),
+        "storage_flush_lag": float(os.getenv("HEALTH_FLUSH_LAG", "300")),
+    },
+    readiness={
+        "event_loop_lag": float(os.getenv("READY_LOOP_LAG", "1")),
+        "updates_age": float(os.getenv("READY_UPDATES_AGE", "90")),
+        "outbound_queue": float(os.getenv("READY_OUTBOUND_QUEUE", "0.8")),
+        "storage_flush_lag": float(os.getenv("READY_FLUSH_LAG", "30")),
+        "webhook_pending": float(os.getenv("READY_WEBHOOK_PENDING", "100")),
+    },
+    interval=float(os.getenv("HEALTH_INTERVAL", "5")),
+)
+bot.session.middleware(UpdatesProbeMiddleware(health_monitor))
+
+gauge("bot_users", "Известные пользователи", lambda: len(user_names))
+gauge("bot_schedule_entries", "Явно заданные дни в расписаниях", lambda: schedules.entry_count())
+gauge("bot_comments", "Комментарии", lambda: len(comment_expiry))
+gauge("bot_outbound_queue_depth", "Уведомления в очереди на отправку", lambda: outbound.queue_depth)
+gauge("bot_outbound_dropped", "Уведомления, отброшенные из-за переполнения очереди", lambda: outbound.dropped)
+gauge("bot_edits_in_flight", "Сообщения с ожидающей правкой клавиатуры", lambda: edits.in_flight)
+gauge("bot_edits_requested", "Запрошенные правки клавиатур", lambda: edits.requested)
+gauge("bot_edits_pushed", "Правки клавиатур, отправленные в Telegram", lambda: edits.pushed)
+gauge("bot_storage_pending", "Изменения, ожидающие записи на диск", lambda: storage.pending_count)
+gauge("bot_fsm_records", "Сохранённые состояния незавершённого ввода", lambda: fsm_storage.size)
+gauge("bot_render_cache_entries", "Записи в кэше отрисовки", lambda: len(render_cache))
+gauge("bot_render_cache_hits", "Отрисовки, взятые из кэша", lambda: render_cache.hits)
+gauge("bot_render_cache_misses", "Отрисовки, выполненные заново", lambda: render_cache.misses)
 
 status_icons = {
     "Выходной": "🛌",
@@ -57,6 +209,18 @@ status_icons = {
     "Больничный": "🩺"
 }
 
+class NameInput(StatesGroup):
+    name = State()
+
+class CommentInput(StatesGroup):
+    text = State()
+
+class PickerSearch(StatesGroup):
+    query = State()
+
+class RangeInput(StatesGroup):
+    dates = State()
+
 class IsAdminFilter(BaseFilter):
     async def __call__(self, message: Message) -> bool:
         return message.from_user.id in ADMINS
@@ -66,8 +230,26 @@ class IsNotRestrictedFilter(BaseFilter):
         return message.from_user.id not in RESTRICTED_USERS
 
 dp.message.filter(IsNotRestrictedFilter())
+# Команды, зарегистрированные ниже обработчиков ввода, не должны стать именем,
+# комментарием или поисковым запросом: состояния переживают перезапуск
+NOT_COMMAND = ~F.text.startswith("/")
 router.message.filter(IsNotRestrictedFilter())
 
+# Ограничение частоты на пользователя: лишние обновления отбрасываются до обработчиков
+message_flood = FloodControlMiddleware(
+    "message",
+    rate=float(os.getenv("FLOOD_MESSAGE_RATE", "1")),
+    burst=int(os.getenv("FLOOD_MESSAGE_BURST", "5"))
+)
+callback_flood = FloodControlMiddleware(
+    "callback",
+    rate=float(os.getenv("FLOOD_CALLBACK_RATE", "4")),
+    burst=int(os.getenv("FLOOD_CALLBACK_BURST", "10"))
+)
+dp.message.outer_middleware(message_flood)
+dp.callback_query.outer_middleware(callback_flood)
+gauge("bot_flood_buckets", "Пользователи с неполным лимитом частоты", lambda: message_flood.size + callback_flood.size)
+
 def get_main_keyboard(user_id: int) -> ReplyKeyboardMarkup:
     buttons = [
         [KeyboardButton(text="🧑‍💼 Мое расписание")],
@@ -80,49 +262,221 @@ def get_main_keyboard(user_id: int) -> ReplyKeyboardMarkup:
         ])
     return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
 
-def initialize_user_work_modes_if_missing(user_id: int):
-    if user_id not in user_work_modes:
-        user_work_modes[user_id] = {}
+DAY_NAMES = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
 
-def build_schedule_keyboard(user_id: int) -> InlineKeyboardMarkup:
+@lru_cache(maxsize=64)
+def day_label(day: date) -> str:
+    return f"{day.strftime('%d.%m')} ({DAY_NAMES[day.weekday()]})"
+
+def clamp_week(week) -> int:
+    return max(0, min(int(week), SCHEDULE_MAX_WEEKS))
+
+def schedule_window(today: date, week: int) -> list:
+    # Вычисляются только видимые дни, статусы по умолчанию нигде не хранятся
+    start = today + timedelta(weeks=week)
+    return [start + timedelta(days=i) for i in range(SCHEDULE_DAYS)]
+
+def window_title(today: date, week: int) -> str:
+    days = schedule_window(today, week)
+    return f"{days[0].strftime('%d.%m')} – {days[-1].strftime('%d.%m')}"
+
+def week_nav(action: str, week: int, *args) -> list:
+    nav = []
+    if week > 0:
+        nav.append(InlineKeyboardButton(text="◀️ Неделя назад", callback_data=callbacks.encode(action, *args, week - 1)))
+    if week < SCHEDULE_MAX_WEEKS:
+        nav.append(InlineKeyboardButton(text="Неделя вперёд ▶️", callback_data=callbacks.encode(action, *args, week + 1)))
+    return nav
+
+def build_schedule_keyboard(user_id: int, week: int = 0) -> InlineKeyboardMarkup:
     today = datetime.now().date()
+    key = ("keyboard", user_id, today, week, render_cache.user_version(user_id))
+    return render_cache.get_or_render(key, lambda: render_schedule_keyboard(user_id, today, week))
+
+def render_schedule_keyboard(user_id: int, today: date, week: int) -> InlineKeyboardMarkup:
     buttons = []
-    initialize_user_work_modes_if_missing(user_id)
+    user_comments_for_user = user_comments.get(user_id, {})
 
-    for i in range(10):
-        day = today + timedelta(days=i)
+    for day in schedule_window(today, week):
         date_str = day.isoformat()
         is_weekend = day.weekday() >= 5
 
-        status = user_work_modes[user_id].get(date_str)
-        if status is None:
-            status = "Выходной" if is_weekend else "Офис"
-            user_work_modes[user_id][date_str] = status
-
+        status = schedules.status(user_id, day)
         icon = status_icons.get(status, "🏢")
-
-        day_name = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"][day.weekday()]
-        btn_text = f"{icon} {day.strftime('%d.%m')} ({day_name})"
+        btn_text = f"{icon} {day_label(day)}"
 
         if is_weekend:
-            callback_data = f"toggle_weekend_{date_str}"
+            callback_data = callbacks.encode("toggle_weekend", date_str, week)
         else:
-            callback_data = f"toggle_{date_str}"
+            callback_data = callbacks.encode("toggle", date_str, week)
 
-        comment_for_day = user_comments.get(user_id, {}).get(date_str)
-        if comment_for_day:
+        if date_str in user_comments_for_user:
             comment_btn = InlineKeyboardButton(
-                text="🗑️ Удалить комментарий", callback_data=f"delete_comment_{date_str}"
+                text="🗑️ Удалить комментарий", callback_data=callbacks.encode("delete_comment", date_str, week)
             )
         else:
             comment_btn = InlineKeyboardButton(
-                text="💬 Добавить комментарий", callback_data=f"add_comment_{date_str}"
+                text="💬 Добавить комментарий", callback_data=callbacks.encode("add_comment", date_str)
             )
 
         buttons.append([InlineKeyboardButton(text=btn_text, callback_data=callback_data), comment_btn])
 
+    buttons.append(week_nav("my_week", week))
+    buttons.append([
+        InlineKeyboardButton(text="📆 Период", callback_data=callbacks.encode("range_start")),
+        InlineKeyboardButton(text="🔁 Шаблон недели", callback_data=callbacks.encode("templates"))
+    ])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+def build_template_keyboard(user_id: int) -> InlineKeyboardMarkup:
+    key = ("templates", user_id, render_cache.user_version(user_id))
+    return render_cache.get_or_render(key, lambda: render_template_keyboard(user_id))
+
+def render_template_keyboard(user_id: int) -> InlineKeyboardMarkup:
+    buttons = []
+    for weekday, day_name in enumerate(DAY_NAMES):
+        code = schedules.template(user_id, weekday)
+        status = status_name(code or default_code(weekday))
+        suffix = "" if code else " (по умолчанию)"
+        buttons.append([InlineKeyboardButton(
+            text=f"{status_icons[status]} {day_name}: {status}{suffix}",
+            callback_data=callbacks.encode("template", weekday)
+        )])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
+def build_user_schedule_text(user_id: int, week: int = 0) -> str:
+    today = datetime.now().date()
+    key = ("user_text", user_id, today, week, render_cache.user_version(user_id))
+    return render_cache.get_or_render(key, lambda: render_user_schedule_text(user_id, today, week))
+
+def render_user_schedule_text(user_id: int, today: date, week: int) -> str:
+    name = html.escape(user_names.get(user_id, "Неизвестный сотрудник"))
+    user_comments_for_user = user_comments.get(user_id, {})
+
+    lines = [f"<b>📅 Расписание {name}:</b>\n"]
+    for day in schedule_window(today, week):
+        icon = status_icons.get(schedules.status(user_id, day), "🏢")
+        line = f"{icon} {day_label(day)}"
+        comment = user_comments_for_user.get(day.isoformat())
+        if comment:
+            line += f"  💬 {html.escape(comment)}"
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+def general_block(uid: int, today: date, week: int) -> str:
+    key = ("general_block", uid, today, week, render_cache.user_version(uid))
+    return render_cache.get_or_render(key, lambda: render_general_block(uid, today, week))
+
+def text_length(text: str) -> int:
+    # Telegram считает длину сообщения в UTF-16: эмодзи занимают 2–3 единицы
+    return len(text.encode("utf-16-le")) // 2
+
+def clip_html(text: str, limit: int) -> str:
+    """Экранирует текст для HTML и обрезает его до limit по экранированной длине.
+
+    Режется исходный текст, поэтому HTML-сущность никогда не разрывается.
+    """
+    escaped = html.escape(text)
+    if text_length(escaped) <= limit:
+        return escaped
+    kept, size = [], 1  # место под «…»
+    for char in text:
+        part = html.escape(char)
+        size += text_length(part)
+        if size > limit:
+            break
+        kept.append(part)
+    return "".join(kept) + "…"
+
+def render_general_block(uid: int, today: date, week: int) -> str:
+    header = f"• {clip_html(str(user_names.get(uid, uid)), GENERAL_NAME_LIMIT)}\n"
+    user_comments_for_user = user_comments.get(uid, {})
+    lines = []
+    for d in schedule_window(today, week):
+        emoji = status_icons.get(schedules.status(uid, d), "🏢")
+        label = f"{d.strftime('%d.%m')}({DAY_NAMES[d.weekday()]})"
+        comment = user_comments_for_user.get(d.isoformat())
+        lines.append((f"  - {label}: {emoji}", comment, text_length(html.escape(comment)) if comment else 0))
+
+    # Комментарии делят оставшееся место блока: короткие остаются целиком,
+    # длинные обрезаются поровну
+    budget = GENERAL_BLOCK_LIMIT - text_length(header) - 1
+    budget -= sum(text_length(line) + 1 for line, _, _ in lines)
+    # Место считается по экранированной длине: «<» превращается в «&lt;»
+    commented = sorted((i for i, (_, comment, _) in enumerate(lines) if comment), key=lambda i: lines[i][2])
+    budget -= len(commented) * text_length("  💬 ")
+    limits = {}
+    for n, i in enumerate(commented):
+        limit = min(GENERAL_COMMENT_LIMIT, max(0, budget) // (len(commented) - n))
+        limits[i] = limit
+        budget -= min(limit, lines[i][2])
+
+    parts = [header]
+    for i, (line, comment, _) in enumerate(lines):
+        if comment and limits[i] > 1:
+            parts.append(f"{line}  💬 {clip_html(comment, limits[i])}\n")
+        else:
+            parts.append(f"{line}\n")
+    parts.append("\n")
+    return "".join(parts)
+
+def general_roster(viewer_id: int) -> list:
+    # Список зависит только от имён и доступа, а не от расписаний, поэтому
+    # переключение дня не заставляет его пересобирать
+    key = ("general_roster", viewer_id, render_cache.roster_version)
+    return render_cache.get_or_render(key, lambda: sorted(
+        (uid for uid in user_names if uid != viewer_id and uid not in RESTRICTED_USERS),
+        key=lambda uid: user_names[uid].lower()
+    ))
+
+def build_general_page(
+    viewer_id: int, page: int, week: int = 0
+) -> Tuple[Optional[str], Optional[InlineKeyboardMarkup]]:
+    today = datetime.now().date()
+    active = general_roster(viewer_id)
+    if not active:
+        return None, None
+    pages = (len(active) + GENERAL_PAGE_USERS - 1) // GENERAL_PAGE_USERS
+    page = max(0, min(page, pages - 1))
+    start = page * GENERAL_PAGE_USERS
+
+    parts = [f"📅 Расписание {window_title(today, week)} (стр. {page + 1}/{pages}):\n\n"]
+    parts.extend(general_block(uid, today, week) for uid in active[start:start + GENERAL_PAGE_USERS])
+
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton(text="◀️", callback_data=callbacks.encode("general_page", page - 1, week)))
+    nav.append(InlineKeyboardButton(text=f"{page + 1}/{pages}", callback_data=callbacks.encode("noop")))
+    if page < pages - 1:
+        nav.append(InlineKeyboardButton(text="▶️", callback_data=callbacks.encode("general_page", page + 1, week)))
+    week_row = week_nav("general_page", week, page)
+    return "".join(parts), InlineKeyboardMarkup(inline_keyboard=[nav, week_row])
+
+@callbacks.route("noop")
+async def noop(callback: CallbackQuery):
+    # Кнопки-подписи вроде счётчика страниц ничего не меняют
+    await callback.answer()
+
+@dp.callback_query()
+async def route_callback(callback: CallbackQuery, state: FSMContext):
+    # Единственный обработчик callback-запросов: разбор данных и поиск по таблице
+    await callbacks.dispatch(callback, state=state)
+
+def schedule_keyboard_update(callback: CallbackQuery, user_id: int, week: int = 0):
+    edits.schedule(
+        callback.message.chat.id,
+        callback.message.message_id,
+        lambda: build_schedule_keyboard(user_id, week)
+    )
+
+def set_user_name(user_id: int, name: str):
+    user_names[user_id] = name
+    name_index.set(user_id, name)
+    render_cache.bump_roster()
+    storage.set_name(user_id, name)
+    storage.log_event(user_id, "name", user_id, name=name)
+    render_cache.bump(user_id)
+
 @dp.message(CommandStart())
 async def start(message: Message):
     user_id = message.from_user.id
@@ -130,7 +484,8 @@ async def start(message: Message):
         await message.answer("⛔ Ваш доступ к боту ограничен администратором")
         return
 
-    user_names[user_id] = message.from_user.full_name
+    if user_names.get(user_id) != message.from_user.full_name:
+        set_user_name(user_id, message.from_user.full_name)
 
     greeting_text = (
         "👋 Привет! Этот бот помогает управлять вашим рабочим расписанием.\n\n"
@@ -147,16 +502,16 @@ async def start(message: Message):
     await message.answer(greeting_text, reply_markup=get_main_keyboard(user_id))
 
 @dp.message(F.text == "✏️ Изменить имя")
-async def change_name_start(message: Message):
+async def change_name_start(message: Message, state: FSMContext):
     user_id = message.from_user.id
     if user_id in RESTRICTED_USERS:
         await message.answer("⛔ Ваш доступ к боту ограничен администратором")
         return
-    awaiting_name_input.add(user_id)
+    await state.set_state(NameInput.name)
     await message.answer("✏️ Введите новое имя для отображения:")
 
-@dp.message(lambda message: message.from_user.id in awaiting_name_input)
-async def save_new_name(message: Message):
+@dp.message(NameInput.name, NOT_COMMAND)
+async def save_new_name(message: Message, state: FSMContext):
     user_id = message.from_user.id
     new_name = message.text.strip()
     if not new_name:
@@ -165,8 +520,8 @@ async def save_new_name(message: Message):
     if len(new_name) > 50:
         await message.answer("❌ Имя слишком длинное. Максимум 50 символов.")
         return
-    user_names[user_id] = new_name
-    awaiting_name_input.discard(user_id)
+    set_user_name(user_id, new_name)
+    await state.clear()
     await message.answer(f"✅ Имя успешно обновлено на: {new_name}", reply_markup=get_main_keyboard(user_id))
 
 @dp.message(F.text == "🧑‍💼 Мое расписание")
@@ -179,16 +534,18 @@ async def my_schedule(message: Message):
     if comment:
         await message.answer(f"💬 Ваш комментарий на сегодня:\n\n{comment}")
 
-@dp.callback_query(lambda c: c.data.startswith("toggle_") and not c.data.startswith("toggle_weekend_"))
-async def toggle_date(callback: CallbackQuery):
+@callbacks.route("my_week", "week")
+async def my_schedule_week(callback: CallbackQuery, week: str):
+    await callback.answer()
+    schedule_keyboard_update(callback, callback.from_user.id, clamp_week(week))
+
+@callbacks.route("toggle", "date_str", "week")
+async def toggle_date(callback: CallbackQuery, date_str: str, week: str):
     try:
         user_id = callback.from_user.id
-        date_str = callback.data[7:]
-        datetime.fromisoformat(date_str)
+        index = day_index(date.fromisoformat(date_str))
 
-        initialize_user_work_modes_if_missing(user_id)
-
-        current = user_work_modes[user_id].get(date_str, "Офис")
+        current = status_name(schedules.get(user_id, index))
         new_status = {
             "Офис": "Дистанционно",
             "Дистанционно": "Командировка",
@@ -197,25 +554,24 @@ async def toggle_date(callback: CallbackQuery):
             "Отпуск": "Офис"
         }.get(current, "Офис")
 
-        user_work_modes[user_id][date_str] = new_status
+        storage.set_status(user_id, date_str, schedules.set(user_id, index, STATUS_CODES[new_status]))
+        storage.log_event(user_id, "status", user_id, date=date_str, status=new_status)
+        render_cache.bump(user_id)
 
-        await callback.message.edit_reply_markup(reply_markup=build_schedule_keyboard(user_id))
         await callback.answer(f"Установлен режим: {new_status}")
+        schedule_keyboard_update(callback, user_id, clamp_week(week))
 
     except Exception as e:
         logger.error(f"Ошибка переключения даты: {e}")
         await callback.answer("Произошла ошибка", show_alert=True)
 
-@dp.callback_query(F.data.startswith("toggle_weekend_"))
-async def toggle_weekend_date(callback: CallbackQuery):
+@callbacks.route("toggle_weekend", "date_str", "week")
+async def toggle_weekend_date(callback: CallbackQuery, date_str: str, week: str):
     try:
         user_id = callback.from_user.id
-        date_str = callback.data[len("toggle_weekend_"):]
-        datetime.fromisoformat(date_str)
-
-        initialize_user_work_modes_if_missing(user_id)
+        index = day_index(date.fromisoformat(date_str))
 
-        current = user_work_modes[user_id].get(date_str, "Выходной")
+        current = status_name(schedules.get(user_id, index))
 
         new_status = {
             "Выходной": "Командировка",
@@ -223,15 +579,132 @@ async def toggle_weekend_date(callback: CallbackQuery):
             "Отпуск": "Выходной"
         }.get(current, "Выходной")
 
-        user_work_modes[user_id][date_str] = new_status
+        storage.set_status(user_id, date_str, schedules.set(user_id, index, STATUS_CODES[new_status]))
+        storage.log_event(user_id, "status", user_id, date=date_str, status=new_status)
+        render_cache.bump(user_id)
 
-        await callback.message.edit_reply_markup(reply_markup=build_schedule_keyboard(user_id))
         await callback.answer(f"Установлен режим: {new_status}")
+        schedule_keyboard_update(callback, user_id, clamp_week(week))
 
     except Exception as e:
         logger.error(f"Ошибка переключения выходного дня: {e}")
         await callback.answer("Произошла ошибка", show_alert=True)
 
+@callbacks.route("range_start")
+async def range_start(callback: CallbackQuery, state: FSMContext):
+    await state.set_state(RangeInput.dates)
+    await callback.message.answer("📆 Введите период в формате ДД.ММ-ДД.ММ, например 01.07-14.07:")
+    await callback.answer()
+
+def parse_range(text: str, today: date) -> Optional[Tuple[date, date]]:
+    try:
+        first, last = (part.strip() for part in text.replace("–", "-").split("-"))
+        start_day, start_month = map(int, first.split("."))
+        end_day, end_month = map(int, last.split("."))
+        start = date(today.year, start_month, start_day)
+        if start < today:
+            start = start.replace(year=today.year + 1)
+        end = date(start.year, end_month, end_day)
+        if end < start:
+            end = end.replace(year=start.year + 1)
+    except ValueError:
+        return None
+    return start, end
+
+@dp.message(RangeInput.dates, NOT_COMMAND)
+async def save_range_dates(message: Message, state: FSMContext):
+    parsed = parse_range(message.text or "", datetime.now().date())
+    if parsed is None:
+        await message.answer("❌ Не удалось разобрать период. Пример: 01.07-14.07")
+        return
+    start, end = parsed
+    if (end - start).days >= RANGE_MAX_DAYS:
+        await message.answer(f"❌ Период не может быть длиннее {RANGE_MAX_DAYS} дней.")
+        return
+    await state.set_state(None)
+    await state.update_data(range_start=start.isoformat(), range_end=end.isoformat())
+    buttons = [
+        [InlineKeyboardButton(text=f"{status_icons[status]} {status}", callback_data=callbacks.encode("range_status", code))]
+        for code, status in enumerate(STATUSES, start=1)
+    ]
+    await message.answer(
+        f"Выберите статус на {start.strftime('%d.%m.%Y')} – {end.strftime('%d.%m.%Y')}:",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
+    )
+
+@callbacks.route("range_status", "code")
+async def set_range_status(callback: CallbackQuery, code: str, state: FSMContext):
+    try:
+        user_id = callback.from_user.id
+        data = await state.get_data()
+        if not data.get("range_start"):
+            await callback.answer("Период не задан, начните заново", show_alert=True)
+            return
+        start = date.fromisoformat(data["range_start"])
+        end = date.fromisoformat(data["range_end"])
+        code = int(code)
+
+        # Весь период — одна пачка записей в хранилище и одна правка сообщения
+        for index, status in schedules.set_range(user_id, day_index(start), day_index(end), code):
+            storage.set_status(user_id, day_date(index).isoformat(), status)
+        storage.log_event(
+            user_id, "range", user_id, start=start.isoformat(), end=end.isoformat(), status=status_name(code)
+        )
+        render_cache.bump(user_id)
+        await state.update_data(range_start=None, range_end=None)
+
+        days = (end - start).days + 1
+        await callback.message.edit_text(
+            f"✅ {start.strftime('%d.%m.%Y')} – {end.strftime('%d.%m.%Y')} ({days} дн.): "
+            f"{status_icons[status_name(code)]} {status_name(code)}"
+        )
+        await callback.answer()
+    except Exception as e:
+        logger.error(f"Ошибка установки статуса на период: {e}")
+        await callback.answer("Произошла ошибка", show_alert=True)
+
+@callbacks.route("templates")
+async def show_templates(callback: CallbackQuery):
+    await callback.message.answer(
+        "🔁 Шаблон недели: статус, который повторяется каждую неделю. "
+        "Изменения конкретных дней важнее шаблона.",
+        reply_markup=build_template_keyboard(callback.from_user.id)
+    )
+    await callback.answer()
+
+@callbacks.route("template", "weekday")
+async def toggle_template(callback: CallbackQuery, weekday: str):
+    try:
+        user_id = callback.from_user.id
+        weekday = int(weekday)
+        current = status_name(schedules.template(user_id, weekday) or default_code(weekday))
+        if weekday >= 5:
+            new_status = {
+                "Выходной": "Офис",
+                "Офис": "Дистанционно",
+                "Дистанционно": "Командировка"
+            }.get(current, "Выходной")
+        else:
+            new_status = {
+                "Офис": "Дистанционно",
+                "Дистанционно": "Командировка",
+                "Командировка": "Выходной"
+            }.get(current, "Офис")
+
+        storage.set_template(user_id, weekday, schedules.set_template(user_id, weekday, STATUS_CODES[new_status]))
+        storage.log_event(user_id, "template", user_id, weekday=weekday, status=new_status)
+        render_cache.bump(user_id)
+
+        await callback.answer(f"{DAY_NAMES[weekday]}: {new_status}")
+        edits.schedule(
+            callback.message.chat.id,
+            callback.message.message_id,
+            lambda: build_template_keyboard(user_id)
+        )
+    except Exception as e:
+        logger.error(f"Ошибка изменения шаблона: {e}")
+        await callback.answer("Произошла ошибка", show_alert=True)
+
 @dp.message(F.text == "👥 Расписание коллег")
 async def colleagues_schedule(message: Message):
     try:
@@ -249,7 +722,9 @@ async def colleagues_schedule(message: Message):
 
         buttons = [
             [InlineKeyboardButton(text="🔎 Выбрать сотрудника", callback_data="select_colleague")],
-            [InlineKeyboardButton(text="📊 Общее расписание", callback_data="general_schedule")]
+            [InlineKeyboardButton(text="📊 Общее расписание", callback_data="general_schedule")],
+            [InlineKeyboardButton(text="📈 Загрузка по дням", callback_data="occupancy")],
+            [InlineKeyboardButton(text="📰 Сводка на сегодня", callback_data="digest")]
         ]
         await message.answer(
             "Выберите действие:",
@@ -259,127 +734,705 @@ async def colleagues_schedule(message: Message):
         logger.error(f"Ошибка в colleagues_schedule: {e}")
         await message.answer("Произошла ошибка при загрузке списка коллег")
 
-@dp.callback_query(F.data == "select_colleague")
+# Назначение списка -> (заголовок, действие кнопки, текст при пустом списке, фильтр)
+PICKERS = {
+    "colleague": (
+        "Выберите сотрудника:", "colleague", "Нет активных пользователей",
+        lambda uid, viewer: uid != viewer and uid not in RESTRICTED_USERS
+    ),
+    "restrict": (
+        "Выберите пользователя для ограничения доступа:", "restrict", "Нет пользователей для ограничения",
+        lambda uid, viewer: uid not in ADMINS and uid not in RESTRICTED_USERS
+    ),
+    "allow": (
+        "Выберите пользователя для восстановления доступа:", "allow", "Нет пользователей с ограниченным доступом",
+        lambda uid, viewer: uid in RESTRICTED_USERS
+    ),
+    "grant": (
+        "Выберите пользователя для назначения администратором:", "grant_admin",
+        "Все пользователи уже являются администраторами",
+        lambda uid, viewer: uid not in ADMINS
+    ),
+    "revoke": (
+        "Выберите администратора для снятия прав:", "revoke_admin", "Нет других администраторов для снятия",
+        lambda uid, viewer: uid in ADMINS and uid != viewer
+    ),
+}
+
+def picker_items(purpose: str, viewer_id: int) -> list:
+    # Кандидаты зависят только от состава и ролей, переключения дней их не меняют
+    key = ("picker", purpose, viewer_id, render_cache.roster_version)
+    return render_cache.get_or_render(key, lambda: render_picker_items(purpose, viewer_id))
+
+def render_picker_items(purpose: str, viewer_id: int) -> list:
+    accept = PICKERS[purpose][3]
+    population = set(user_names) | ADMINS | RESTRICTED_USERS
+    items = [(uid, user_names.get(uid, str(uid))) for uid in population if accept(uid, viewer_id)]
+    items.sort(key=lambda item: normalize(item[1]))
+    return items
+
+def build_picker(purpose: str, viewer_id: int, page: int, query: Optional[str] = None):
+    title, action, empty_text, accept = PICKERS[purpose]
+    if query:
+        items = [
+            (uid, user_names[uid]) for uid in name_index.search(query)
+            if uid in user_names and accept(uid, viewer_id)
+        ]
+        items.sort(key=lambda item: normalize(item[1]))
+        title += f"\n🔎 «{query}»: найдено {len(items)}"
+        extra = [InlineKeyboardButton(text="✖️ Сбросить поиск", callback_data=callbacks.encode("pick_reset", purpose))]
+    else:
+        items = picker_items(purpose, viewer_id)
+        if not items:
+            return empty_text, None
+        extra = [InlineKeyboardButton(text="🔎 Поиск по имени", callback_data=callbacks.encode("pick_search", purpose))]
+
+    markup, _, _ = picker_keyboard(
+        items, page, PICKER_PAGE_SIZE,
+        item_data=lambda uid: callbacks.encode(action, uid),
+        # Признак поиска в данных кнопки: иначе старый запрос из FSM
+        # подхватился бы при листании заново открытого полного списка
+        page_data=lambda p: callbacks.encode("pick", purpose, p, int(bool(query))),
+        counter_data=callbacks.encode("noop"),
+        extra_row=extra
+    )
+    return title, markup
+
+async def show_picker(callback: CallbackQuery, purpose: str, page: int = 0, query: Optional[str] = None):
+    if callback.from_user.id not in ADMINS:
+        await callback.answer("⛔ Нет доступа", show_alert=True)
+        return
+    text, markup = build_picker(purpose, callback.from_user.id, page, query)
+    if markup is None:
+        await callback.answer(text, show_alert=True)
+        return
+    await callback.message.edit_text(text, reply_markup=markup)
+    await callback.answer()
+
+@callbacks.route("pick", "purpose", "page", "search", admin=True)
+async def picker_page(callback: CallbackQuery, purpose: str, page: str, search: str, state: FSMContext):
+    try:
+        query = None
+        if search == "1":
+            data = await state.get_data()
+            if data.get("picker_purpose") == purpose:
+                query = data.get("picker_query")
+        await show_picker(callback, purpose, int(page), query)
+    except Exception as e:
+        logger.error(f"Ошибка в picker_page: {e}")
+        await callback.answer("Ошибка загрузки списка", show_alert=True)
+
+@callbacks.route("pick_search", "purpose", admin=True)
+async def picker_search_start(callback: CallbackQuery, purpose: str, state: FSMContext):
+    await state.set_state(PickerSearch.query)
+    await state.update_data(picker_purpose=purpose, picker_query=None)
+    await callback.message.answer("🔎 Введите начало имени или фамилии:")
+    await callback.answer()
+
+@callbacks.route("pick_reset", "purpose", admin=True)
+async def picker_search_reset(callback: CallbackQuery, purpose: str, state: FSMContext):
+    try:
+        await state.update_data(picker_query=None)
+        await show_picker(callback, purpose)
+    except Exception as e:
+        logger.error(f"Ошибка в picker_search_reset: {e}")
+        await callback.answer("Ошибка загрузки списка", show_alert=True)
+
+@callbacks.route("select_colleague", admin=True)
 async def select_colleague(callback: CallbackQuery):
     try:
-        active_users = {
-            uid: name for uid, name in user_names.items()
-            if uid != callback.from_user.id and uid not in RESTRICTED_USERS
-        }
-        buttons = [
-            [InlineKeyboardButton(text=name, callback_data=f"colleague_{uid}")]
-            for uid, name in active_users.items()
-        ]
-        await callback.message.edit_text(
-            "Выберите сотрудника:",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
-        )
-        await callback.answer()
+        await show_picker(callback, "colleague")
     except Exception as e:
         logger.error(f"Ошибка в select_colleague: {e}")
         await callback.answer("Ошибка загрузки списка", show_alert=True)
 
-@dp.callback_query(F.data == "general_schedule")
+@callbacks.route("general_schedule", admin=True)
 async def general_schedule(callback: CallbackQuery):
     try:
-        active_users = {
-            uid: name for uid, name in user_names.items()
-            if uid != callback.from_user.id and uid not in RESTRICTED_USERS
-        }
-        if not active_users:
+        text, markup = build_general_page(callback.from_user.id, 0)
+        if text is None:
             await callback.answer("Нет активных пользователей", show_alert=True)
             return
 
-        today = datetime.now().date()
-        dates = [today + timedelta(days=i) for i in range(10)]
-        day_names = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
-
-        text = "📅 Расписание:\n\n"
-        for uid, name in active_users.items():
-            text += f"• {name}\n"
-            user_comments_for_user = user_comments.get(uid, {})
-            for d in dates:
-                date_str = d.isoformat()
-                comment = user_comments_for_user.get(date_str)
-                status = user_work_modes.get(uid, {}).get(date_str)
-                if status is None:
-                    status = "Выходной" if d.weekday() >= 5 else "Офис"
-                emoji = status_icons.get(status, "🏢")
-                day_name = day_names[d.weekday()]
-                text += f"  - {d.strftime('%d.%m')}({day_name}): {emoji}"
-                if comment:
-                    text += f"  💬 {comment}"
-                text += "\n"
-            text += "\n"
-
-        await callback.message.answer(text)
+        await callback.message.answer(text, reply_markup=markup)
         await callback.answer()
     except Exception as e:
         logger.error(f"Ошибка в general_schedule: {e}")
         await callback.answer("Ошибка формирования общего расписания", show_alert=True)
 
-@dp.callback_query(F.data.startswith("colleague_"))
-async def show_user_schedule(callback: CallbackQuery):
+@callbacks.route("general_page", "page", "week", admin=True)
+async def general_schedule_page(callback: CallbackQuery, page: str, week: str):
+    try:
+        text, markup = build_general_page(callback.from_user.id, int(page), clamp_week(week))
+        if text is None:
+            await callback.answer("Нет активных пользователей", show_alert=True)
+            return
+
+        # Telegram хранит текст без завершающих переводов строки
+        if text.strip() != (callback.message.text or "").strip():
+            await callback.message.edit_text(text, reply_markup=markup)
+        await callback.answer()
+    except Exception as e:
+        logger.error(f"Ошибка в general_schedule_page: {e}")
+        await callback.answer("Ошибка формирования общего расписания", show_alert=True)
+
+def active_user_count() -> int:
+    return len(user_names) - sum(1 for uid in RESTRICTED_USERS if uid in user_names)
+
+def day_headcount(index: int) -> Dict[int, int]:
+    # Явные статусы и шаблоны берутся из обратных индексов, остальные
+    # активные сотрудники получают статус дня по умолчанию
+    counts = {code: len(users) for code, users in schedules.day_overrides(index).items()}
+    for uid in RESTRICTED_USERS:
+        code = schedules.override(uid, index)
+        if code and uid in user_names:
+            counts[code] -= 1
+    for code, users in schedules.weekday_templates(index).items():
+        for uid in users:
+            if uid in user_names and uid not in RESTRICTED_USERS and not schedules.override(uid, index):
+                counts[code] = counts.get(code, 0) + 1
+    default = default_code(index)
+    counts[default] = counts.get(default, 0) + active_user_count() - sum(counts.values())
+    return {code: count for code, count in counts.items() if count > 0}
+
+def day_roster(index: int) -> Dict[int, list]:
+    roster = {}
+    overridden = set()
+    for code, users in schedules.day_overrides(index).items():
+        overridden |= users
+        names = [user_names[uid] for uid in users if uid in user_names and uid not in RESTRICTED_USERS]
+        if names:
+            roster[code] = sorted(names)
+    for code, users in schedules.weekday_templates(index).items():
+        names = [
+            user_names[uid] for uid in users
+            if uid not in overridden and uid in user_names and uid not in RESTRICTED_USERS
+        ]
+        overridden |= users
+        if names:
+            roster[code] = sorted(roster.get(code, []) + names)
+    default_names = [
+        name for uid, name in user_names.items()
+        if uid not in overridden and uid not in RESTRICTED_USERS
+    ]
+    if default_names:
+        # Явный статус может совпадать со статусом дня по умолчанию, если шаблон другой
+        code = default_code(index)
+        roster[code] = sorted(roster.get(code, []) + default_names)
+    return roster
+
+# Сводка считается один раз в день и раздаётся всем админам из одного экземпляра
+digest_cache: Dict[date, Tuple[str, InlineKeyboardMarkup]] = {}
+
+def limit_names(names: list, limit: int = 600) -> str:
+    # Имена экранируются для HTML, длина считается по экранированному тексту
+    shown, size = [], 0
+    for name in names:
+        escaped = html.escape(name)
+        size += text_length(escaped) + 2
+        if size > limit:
+            break
+        shown.append(escaped)
+    text = ", ".join(shown)
+    if len(shown) < len(names):
+        text = f"{text} и ещё {len(names) - len(shown)}".lstrip()
+    return text
+
+def render_digest_day(day: date) -> list:
+    index = day_index(day)
+    counts = day_headcount(index)
+    roster = day_roster(index)
+    lines = [f"<b>📅 {day_label(day)}</b>"]
+    lines.append(" · ".join(
+        f"{status_icons[status]} {counts[code]}" for code, status in enumerate(STATUSES, start=1) if code in counts
+    ) or "—")
+    for status in ABSENT_STATUSES:
+        names = roster.get(STATUS_CODES[status])
+        if names:
+            lines.append(f"{status_icons[status]} {status}: {limit_names(names)}")
+
+    date_str = day.isoformat()
+    commented = sorted(
+        (uid for uid in comment_expiry.get(index) if uid in user_names and uid not in RESTRICTED_USERS),
+        key=lambda uid: user_names[uid].lower()
+    )
+    for uid in commented[:DIGEST_COMMENT_LIMIT]:
+        comment = user_comments.get(uid, {}).get(date_str)
+        if comment:
+            if len(comment) > GENERAL_COMMENT_LIMIT:
+                comment = comment[:GENERAL_COMMENT_LIMIT] + "…"
+            # Сводка размечена HTML: «<3» в комментарии сломал бы её для всех админов
+            lines.append(f"💬 {html.escape(user_names[uid])}: {html.escape(comment)}")
+    if len(commented) > DIGEST_COMMENT_LIMIT:
+        lines.append(f"💬 … и ещё {len(commented) - DIGEST_COMMENT_LIMIT}")
+    return lines
+
+def render_digest(today: date) -> Tuple[str, InlineKeyboardMarkup]:
+    lines = [f"<b>📰 Сводка по команде</b> (на {datetime.now().strftime('%H:%M')})\n"]
+    lines.extend(render_digest_day(today))
+    lines.append("")
+    lines.extend(render_digest_day(today + timedelta(days=1)))
+    text = "\n".join(lines)
+    if text_length(text) > TELEGRAM_TEXT_LIMIT:
+        # Отбрасываем строки целиком, чтобы не разрезать тег или HTML-сущность
+        kept, size = [], text_length("\n…")
+        for line in lines:
+            size += text_length(line) + 1
+            if size > TELEGRAM_TEXT_LIMIT:
+                break
+            kept.append(line)
+        text = "\n".join(kept) + "\n…"
+    markup = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔄 Обновить", callback_data=callbacks.encode("digest_refresh"))]
+    ])
+    return text, markup
+
+def build_digest(today: date, refresh: bool = False) -> Tuple[str, InlineKeyboardMarkup]:
+    if refresh or today not in digest_cache:
+        digest_cache.clear()
+        digest_cache[today] = render_digest(today)
+    return digest_cache[today]
+
+async def digest_daily():
+    if not DIGEST_TIME:
+        return
+    try:
+        send_at = datetime.strptime(DIGEST_TIME, "%H:%M").time()
+    except ValueError:
+        logger.error(f"Неверный формат DIGEST_TIME: {DIGEST_TIME!r}, ожидается ЧЧ:ММ")
+        return
+    while True:
+        now = datetime.now()
+        next_run = datetime.combine(now.date(), send_at)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        await asyncio.sleep((next_run - now).total_seconds())
+        try:
+            text, markup = build_digest(next_run.date(), refresh=True)
+            # Очередь уведомлений сама выдерживает лимиты Telegram
+            for admin_id in ADMINS:
+                outbound.notify(admin_id, text, reply_markup=markup)
+            logger.info(f"Сводка поставлена в очередь для {len(ADMINS)} админов")
+        except Exception as e:
+            logger.error(f"Ошибка формирования сводки: {e}")
+
+@callbacks.route("digest", admin=True)
+async def digest_handler(callback: CallbackQuery):
+    try:
+        text, markup = build_digest(datetime.now().date())
+        await callback.message.answer(text, reply_markup=markup)
+        await callback.answer()
+    except Exception as e:
+        logger.error(f"Ошибка в digest_handler: {e}")
+        await callback.answer("Ошибка формирования сводки", show_alert=True)
+
+@callbacks.route("digest_refresh", admin=True)
+async def digest_refresh(callback: CallbackQuery):
+    try:
+        text, markup = build_digest(datetime.now().date(), refresh=True)
+        try:
+            await callback.message.edit_text(text, reply_markup=markup)
+        except TelegramBadRequest as e:
+            # Сводка не изменилась с прошлого обновления
+            if "message is not modified" not in str(e):
+                raise
+        await callback.answer("Сводка обновлена")
+    except Exception as e:
+        logger.error(f"Ошибка в digest_refresh: {e}")
+        await callback.answer("Ошибка формирования сводки", show_alert=True)
+
+@callbacks.route("occupancy", admin=True)
+async def occupancy_overview(callback: CallbackQuery):
     try:
-        user_id = int(callback.data.split('_')[1])
-        name = user_names.get(user_id, "Неизвестный сотрудник")
-        user_comments_for_user = user_comments.get(user_id, {})
 
-        text = f"<b>📅 Расписание {name}:</b>\n\n"
         today = datetime.now().date()
-        for i in range(10):
-            day = today + timedelta(days=i)
-            date_str = day.isoformat()
-            is_weekend = day.weekday() >= 5
-            if is_weekend:
-                status = user_work_modes.get(user_id, {}).get(date_str, "Выходной")
-            else:
-                status = user_work_modes.get(user_id, {}).get(date_str, "Офис")
-            icon = status_icons.get(status, "🏢")
-            day_name = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"][day.weekday()]
-            comment = user_comments_for_user.get(date_str)
-            text += f"{icon} {day.strftime('%d.%m')} ({day_name})"
-            if comment:
-                text += f"  💬 {comment}"
-            text += "\n"
-
-        await callback.message.answer(text, parse_mode=ParseMode.HTML)
+        lines = ["📈 Загрузка по дням:\n"]
+        buttons = []
+        for day in schedule_window(today, 0):
+            counts = day_headcount(day_index(day))
+            summary = " · ".join(
+                f"{status_icons[status]} {counts[code]}"
+                for code, status in enumerate(STATUSES, start=1) if code in counts
+            )
+            lines.append(f"{day_label(day)}: {summary or '—'}")
+            buttons.append([InlineKeyboardButton(text=day_label(day), callback_data=callbacks.encode("occupancy_day", day.isoformat()))])
+
+        await callback.message.answer("\n".join(lines), reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons))
+        await callback.answer()
+    except Exception as e:
+        logger.error(f"Ошибка в occupancy_overview: {e}")
+        await callback.answer("Ошибка подсчёта загрузки", show_alert=True)
+
+@callbacks.route("occupancy_day", "date_str", admin=True)
+async def occupancy_day(callback: CallbackQuery, date_str: str):
+    try:
+
+        day = date.fromisoformat(date_str)
+        index = day_index(day)
+        roster = day_roster(index)
+        # Списки и счётчики считаются разными путями и обязаны сходиться
+        counts = day_headcount(index)
+        if any(len(roster.get(code, ())) != count for code, count in counts.items()):
+            logger.warning(f"Разбивка дня {date_str} расходится со счётчиками: {counts}")
+        lines = [f"<b>📅 {day_label(day)}</b>\n"]
+        for code, status in enumerate(STATUSES, start=1):
+            names = roster.get(code)
+            if names:
+                lines.append(f"{status_icons[status]} {status} ({len(names)}): {limit_names(names, OCCUPANCY_NAMES_LIMIT)}")
+        if len(lines) == 1:
+            lines.append("Нет активных пользователей")
+
+        await callback.message.answer("\n".join(lines))
+        await callback.answer()
+    except Exception as e:
+        logger.error(f"Ошибка в occupancy_day: {e}")
+        await callback.answer("Ошибка загрузки списка", show_alert=True)
+
+def colleague_markup(user_id: int, week: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        week_nav("colleague_week", week, user_id),
+        [InlineKeyboardButton(text="📜 История изменений", callback_data=callbacks.encode("history", user_id))]
+    ])
+
+@callbacks.route("colleague", "user_id", admin=True)
+async def show_user_schedule(callback: CallbackQuery, user_id: str):
+    try:
+        user_id = int(user_id)
+        text = build_user_schedule_text(user_id)
+        markup = colleague_markup(user_id, 0)
+
+        await callback.message.answer(text, parse_mode=ParseMode.HTML, reply_markup=markup)
         await callback.answer()
     except Exception as e:
         logger.error(f"Ошибка в show_user_schedule: {e}")
         await callback.answer("Ошибка загрузки расписания", show_alert=True)
 
-@dp.callback_query(F.data.startswith("add_comment_"))
-async def add_comment_handler(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    date_str = callback.data[len("add_comment_"):]
-    awaiting_comment_input[user_id] = date_str
+@callbacks.route("colleague_week", "user_id", "week", admin=True)
+async def show_user_schedule_week(callback: CallbackQuery, user_id: str, week: str):
+    try:
+        user_id, week = int(user_id), clamp_week(week)
+        text = build_user_schedule_text(user_id, week)
+        markup = colleague_markup(user_id, week)
+
+        await callback.message.edit_text(text, parse_mode=ParseMode.HTML, reply_markup=markup)
+        await callback.answer()
+    except Exception as e:
+        logger.error(f"Ошибка в show_user_schedule_week: {e}")
+        await callback.answer("Ошибка загрузки расписания", show_alert=True)
+
+@callbacks.route("add_comment", "date_str")
+async def add_comment_handler(callback: CallbackQuery, date_str: str, state: FSMContext):
+    await state.set_state(CommentInput.text)
+    await state.update_data(date=date_str)
     await callback.message.answer(f"💬 Введите комментарий на {date_str} (будет виден только администраторам):")
     await callback.answer()
 
-@dp.message(lambda m: m.from_user.id in awaiting_comment_input)
-async def save_comment_handler(message: Message):
+@dp.message(CommentInput.text, NOT_COMMAND)
+async def save_comment_handler(message: Message, state: FSMContext):
     user_id = message.from_user.id
     comment = message.text.strip()
     if not comment:
         await message.answer("❌ Комментарий не может быть пустым. Попробуйте ещё раз.")
         return
-    date_str = awaiting_comment_input[user_id]
+    date_str = (await state.get_data())["date"]
     user_comments.setdefault(user_id, {})[date_str] = comment
-    del awaiting_comment_input[user_id]
+    comment_expiry.add(day_index(date.fromisoformat(date_str)), user_id)
+    storage.set_comment(user_id, date_str, comment)
+    storage.log_event(user_id, "comment", user_id, date=date_str)
+    render_cache.bump(user_id)
+    await state.clear()
     await message.answer(f"✅ Ваш комментарий на {date_str} сохранён.", reply_markup=get_main_keyboard(user_id))
 
-@dp.callback_query(F.data.startswith("delete_comment_"))
-async def delete_comment_handler(callback: CallbackQuery):
+@callbacks.route("delete_comment", "date_str", "week")
+async def delete_comment_handler(callback: CallbackQuery, date_str: str, week: str):
     user_id = callback.from_user.id
-    date_str = callback.data[len("delete_comment_"):]
     if user_id in user_comments and date_str in user_comments[user_id]:
         del user_comments[user_id][date_str]
+        comment_expiry.discard(day_index(date.fromisoformat(date_str)), user_id)
+        storage.set_comment(user_id, date_str, None)
+        storage.log_event(user_id, "comment_delete", user_id, date=date_str)
+        render_cache.bump(user_id)
         await callback.answer("Комментарий удалён")
-        await callback.message.edit_reply_markup(reply_markup=build_schedule_keyboard(user_id))
+        schedule_keyboard_update(callback, user_id, clamp_week(week))
     else:
         await callback.answer("Комментарий отсутствует", show_alert=True)
 
+@dp.message(PickerSearch.query, NOT_COMMAND)
+async def picker_search_query(message: Message, state: FSMContext):
+    query = (message.text or "").strip()
+    if not query:
+        await message.answer("❌ Запрос не может быть пустым. Попробуйте ещё раз.")
+        return
+    data = await state.get_data()
+    purpose = data.get("picker_purpose")
+    await state.set_state(None)
+    if purpose not in PICKERS or message.from_user.id not in ADMINS:
+        return
+    await state.update_data(picker_query=query)
+    text, markup = build_picker(purpose, message.from_user.id, 0, query)
+    await message.answer(text, reply_markup=markup)
+
+EVENT_TEXTS = {
+    "name": lambda data: f"имя → {data['name']}",
+    "status": lambda data: f"{date.fromisoformat(data['date']).strftime('%d.%m')} → {data['status']}",
+    "range": lambda data: (
+        f"{date.fromisoformat(data['start']).strftime('%d.%m')}–"
+        f"{date.fromisoformat(data['end']).strftime('%d.%m')} → {data['status']}"
+    ),
+    "template": lambda data: f"шаблон {DAY_NAMES[data['weekday']]} → {data['status']}",
+    "comment": lambda data: f"комментарий на {date.fromisoformat(data['date']).strftime('%d.%m')}",
+    "comment_delete": lambda data: f"удалён комментарий на {date.fromisoformat(data['date']).strftime('%d.%m')}",
+    "restrict": lambda data: "доступ ограничен",
+    "allow": lambda data: "доступ восстановлен",
+    "grant_admin": lambda data: "назначен администратором",
+    "revoke_admin": lambda data: "сняты права администратора",
+}
+
+def display_name(user_id: int) -> str:
+    return html.escape(str(user_names.get(user_id, user_id)))
+
+def format_history(events: list, target: Optional[int]) -> str:
+    title = f"📜 История: {display_name(target)}" if target is not None else "📜 Последние изменения"
+    lines = [f"<b>{title}</b>\n"]
+    for event in events:
+        when = datetime.fromisoformat(event.at).strftime("%d.%m %H:%M")
+        describe = EVENT_TEXTS.get(event.action)
+        # Текст события может содержать имя, а сообщение размечено HTML
+        what = html.escape(describe(event.data) if describe else event.action)
+        line = f"{when} {what}"
+        if target is None:
+            line = f"{when} {display_name(event.target)}: {what}"
+        if event.actor != event.target:
+            line += f" (👤 {display_name(event.actor)})"
+        lines.append(line)
+    if len(lines) == 1:
+        lines.append("Изменений нет")
+    return "\n".join(lines)
+
+@dp.message(Command("history"))
+async def history_command(message: Message):
+    try:
+        if message.from_user.id not in ADMINS:
+            await message.answer("⛔ У вас нет прав доступа к этой функции")
+            return
+
+        parts = (message.text or "").split(maxsplit=1)
+        target = None
+        if len(parts) > 1:
+            query = parts[1].strip()
+            if query.isdigit():
+                target = int(query)
+            else:
+                found = name_index.search(query)
+                if not found:
+                    await message.answer("Пользователь не найден")
+                    return
+                if len(found) > 1:
+                    names = "\n".join(f"{user_names.get(uid, uid)} — /history {uid}" for uid in found[:10])
+                    await message.answer(f"Найдено несколько пользователей, уточните:\n{names}")
+                    return
+                target = found[0]
+
+        events = await storage.history_async(target, HISTORY_LIMIT)
+        await message.answer(format_history(events, target))
+    except Exception as e:
+        logger.error(f"Ошибка в history_command: {e}")
+        await message.answer("Ошибка загрузки истории")
+
+@callbacks.route("history", "user_id", admin=True)
+async def history_callback(callback: CallbackQuery, user_id: str):
+    try:
+        user_id = int(user_id)
+        events = await storage.history_async(user_id, HISTORY_LIMIT)
+        await callback.message.answer(format_history(events, user_id))
+        await callback.answer()
+    except Exception as e:
+        logger.error(f"Ошибка в history_callback: {e}")
+        await callback.answer("Ошибка загрузки истории", show_alert=True)
+
+@dp.message(Command("analytics"))
+async def analytics_command(message: Message):
+    try:
+        if message.from_user.id not in ADMINS:
+            await message.answer("⛔ У вас нет прав доступа к этой функции")
+            return
+        if not analytics.available():
+            await message.answer("Аналитика недоступна: не установлен numpy")
+            return
+
+        parts = (message.text or "").split()
+        days = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else ANALYTICS_DAYS
+        days = max(1, min(days, ANALYTICS_MAX_DAYS))
+        today = datetime.now().date()
+        start = today - timedelta(days=days - 1)
+
+        # Прошлые дни — из базы, сегодняшние изменения — из памяти
+        overrides = await storage.schedule_history_async(start.isoformat(), today.isoformat())
+        users = sorted(uid for uid in user_names if uid not in RESTRICTED_USERS)
+        overrides += [(uid, today.isoformat(), schedules.status(uid, today)) for uid in users]
+        text, chart = await asyncio.to_thread(
+            analytics.run_report, users, start, days, schedules.template_table(), overrides, dict(user_names)
+        )
+        await message.answer(text)
+        if chart is not None:
+            await message.answer_photo(BufferedInputFile(chart, filename="analytics.png"))
+    except Exception as e:
+        logger.error(f"Ошибка в analytics_command: {e}")
+        await message.answer("Ошибка расчёта аналитики")
+
+async def load_export_history(start: date, end: date) -> Tuple[dict, dict]:
+    # В памяти только дни с сегодняшнего, прошлые берутся из базы
+    today = datetime.now().date()
+    if start >= today:
+        return {}, {}
+    last = min(end, today - timedelta(days=1)).isoformat()
+    statuses = await storage.schedule_history_async(start.isoformat(), last)
+    comments = await storage.comment_history_async(start.isoformat(), last)
+    return (
+        {(uid, day): status for uid, day, status in statuses},
+        {(uid, day): comment for uid, day, comment in comments}
+    )
+
+def export_rows(start: date, end: date, past_statuses: dict, past_comments: dict):
+    today = datetime.now().date()
+    # Без архива дни старше срока хранения неизвестны: ячейки остаются пустыми,
+    # а не заполняются статусом по умолчанию
+    known_from = date.min if ARCHIVE_PATH else today - timedelta(days=RETENTION_DAYS)
+    days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    yield ["user_id", "Имя", *(day.isoformat() for day in days)]
+    users = sorted(
+        (uid for uid in user_names if uid not in RESTRICTED_USERS),
+        key=lambda uid: user_names[uid].lower()
+    )
+    for uid in users:
+        comments = user_comments.get(uid, {})
+        row = [uid, user_names[uid]]
+        for day in days:
+            date_str = day.isoformat()
+            if day >= today:
+                status = schedules.status(uid, day)
+                comment = comments.get(date_str)
+            else:
+                status = past_statuses.get((uid, date_str))
+                if status is None and day >= known_from:
+                    status = status_name(schedules.base_code(uid, day_index(day)))
+                comment = past_comments.get((uid, date_str))
+            row.append(f"{status}: {comment}" if comment and status else status or comment or "")
+        yield row
+
+async def collect_rows(rows) -> list:
+    # Строки собираются в event loop пачками, а сама книга XLSX строится в потоке
+    collected = []
+    for row in rows:
+        collected.append(row)
+        if len(collected) % EXPORT_YIELD_ROWS == 0:
+            await asyncio.sleep(0)
+    return collected
+
+def parse_export_range(args: list, today: date) -> Optional[Tuple[date, date]]:
+    if not args:
+        return today, today + timedelta(days=SCHEDULE_DAYS - 1)
+    try:
+        start = datetime.strptime(args[0], "%d.%m.%Y").date()
+        end = datetime.strptime(args[1], "%d.%m.%Y").date() if len(args) > 1 else start
+    except ValueError:
+        return None
+    if end < start or (end - start).days >= EXPORT_MAX_DAYS:
+        return None
+    return start, end
+
+@dp.message(Command("export"))
+async def export_command(message: Message):
+    try:
+        if message.from_user.id not in ADMINS:
+            await message.answer("⛔ У вас нет прав доступа к этой функции")
+            return
+
+        args = (message.text or "").split()[1:]
+        as_xlsx = bool(args) and args[-1].lower() == "xlsx"
+        if as_xlsx:
+            args = args[:-1]
+        parsed = parse_export_range(args, datetime.now().date())
+        if parsed is None:
+            await message.answer(
+                f"❌ Формат: /export ДД.ММ.ГГГГ ДД.ММ.ГГГГ [xlsx], не больше {EXPORT_MAX_DAYS} дней"
+            )
+            return
+        if as_xlsx and not export.xlsx_available():
+            await message.answer("XLSX недоступен: не установлен openpyxl")
+            return
+
+        start, end = parsed
+        past_statuses, past_comments = await load_export_history(start, end)
+        rows = export_rows(start, end, past_statuses, past_comments)
+        filename = f"schedule_{start.isoformat()}_{end.isoformat()}"
+        if as_xlsx:
+            data = await asyncio.to_thread(export.write_xlsx, await collect_rows(rows))
+            filename += ".xlsx"
+        else:
+            buffer = io.BytesIO()
+            for chunk in export.csv_chunks(rows):
+                buffer.write(chunk)
+                # Большая выгрузка не должна надолго занимать event loop
+                await asyncio.sleep(0)
+            data = buffer.getvalue()
+            filename += ".csv"
+        await message.answer_document(BufferedInputFile(data, filename=filename))
+    except Exception as e:
+        logger.error(f"Ошибка в export_command: {e}")
+        await message.answer("Ошибка формирования выгрузки")
+
+def feed_token(subject: str) -> str:
+    return hmac.new(ICAL_SECRET.encode(), subject.encode(), hashlib.sha256).hexdigest()[:32]
+
+def feed_url(subject: str, path: str) -> str:
+    return f"{PUBLIC_URL.rstrip('/')}/ical/{path}/{feed_token(subject)}.ics"
+
+def user_feed_runs(uid: int, today: date):
+    comments = user_comments.get(uid, {})
+    days = []
+    for i in range(ICAL_DAYS):
+        day = today + timedelta(days=i)
+        index = day_index(day)
+        code = schedules.get(uid, index)
+        comment = comments.get(day.isoformat(), "")
+        # Обычные дни в календарь не попадают, если к ним нет комментария
+        status = status_name(code) if code != default_code(index) or comment else None
+        days.append((day, status, comment))
+    return ical.runs(days)
+
+def render_user_feed(uid: int, today: date) -> bytes:
+    events = [
+        ical.Event(f"{uid}-{start.isoformat()}@dcl-bot", start, end, f"{status_icons[status]} {status}", "\n".join(notes))
+        for start, end, status, notes in user_feed_runs(uid, today)
+    ]
+    return ical.render(f"Расписание: {user_names.get(uid, uid)}", events)
+
+def render_team_feed(today: date) -> bytes:
+    events = []
+    for uid, name in user_names.items():
+        if uid in RESTRICTED_USERS:
+            continue
+        events.extend(
+            ical.Event(f"{uid}-{start.isoformat()}@dcl-bot", start, end, f"{name}: {status_icons[status]} {status}", "\n".join(notes))
+            for start, end, status, notes in user_feed_runs(uid, today)
+        )
+    return ical.render("Расписание команды", events)
+
+@dp.message(Command("calendar"))
+async def calendar_command(message: Message):
+    if not ICAL_SECRET or not PUBLIC_URL:
+        await message.answer("Подписка на календарь не настроена")
+        return
+    user_id = message.from_user.id
+    lines = [
+        "📆 Добавьте ссылку в календарь как подписку (не делитесь ей):",
+        feed_url(f"user:{user_id}", str(user_id)),
+    ]
+    if user_id in ADMINS:
+        lines.extend(["", "Календарь всей команды:", feed_url("team", "team")])
+    await message.answer("\n".join(lines), disable_web_page_preview=True)
+
 @dp.message(F.text == "⚙️ Управление доступом")
 async def access_management(message: Message):
     if message.from_user.id not in ADMINS:
@@ -402,76 +1455,58 @@ async def access_management(message: Message):
         logger.error(f"Ошибка в access_management: {e}")
         await message.answer("Произошла ошибка при загрузке меню управления")
 
-@dp.callback_query(F.data == "restrict_access")
+@callbacks.route("restrict_access", admin=True)
 async def restrict_access_handler(callback: CallbackQuery):
     try:
-        available_users = [
-            [InlineKeyboardButton(text=user_names.get(uid, str(uid)), callback_data=f"restrict_{uid}")]
-            for uid in user_names if uid not in ADMINS and uid not in RESTRICTED_USERS
-        ]
-        if not available_users:
-            await callback.answer("Нет пользователей для ограничения", show_alert=True)
-            return
-
-        await callback.message.edit_text(
-            "Выберите пользователя для ограничения доступа:",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=available_users)
-        )
+        await show_picker(callback, "restrict")
     except Exception as e:
         logger.error(f"Ошибка в restrict_access_handler: {e}")
         await callback.answer("Ошибка обработки", show_alert=True)
 
-@dp.callback_query(F.data.startswith("restrict_"))
-async def restrict_user(callback: CallbackQuery):
+@callbacks.route("restrict", "user_id", admin=True)
+async def restrict_user(callback: CallbackQuery, user_id: str):
     try:
-        user_id = int(callback.data.split('_')[1])
+        user_id = int(user_id)
         RESTRICTED_USERS.add(user_id)
+        render_cache.bump_roster()
+        storage.set_role(user_id, "restricted", True)
+        storage.log_event(callback.from_user.id, "restrict", user_id)
+        render_cache.bump(user_id)
         if user_id in user_comments:
-            del user_comments[user_id]
+            for date_str in user_comments.pop(user_id):
+                comment_expiry.discard(day_index(date.fromisoformat(date_str)), user_id)
+                storage.set_comment(user_id, date_str, None)
         await callback.message.edit_text(
             f"⛔ Пользователь {user_names.get(user_id, user_id)} теперь без доступа"
         )
-        try:
-            await bot.send_message(user_id, "⛔ Ваш доступ к боту был ограничен администратором")
-        except:
-            logger.warning(f"Не удалось уведомить пользователя {user_id}")
+        outbound.notify(user_id, "⛔ Ваш доступ к боту был ограничен администратором")
         await callback.answer()
     except Exception as e:
         logger.error(f"Ошибка в restrict_user: {e}")
         await callback.answer("Ошибка операции", show_alert=True)
 
-@dp.callback_query(F.data == "allow_access")
+@callbacks.route("allow_access", admin=True)
 async def allow_access_handler(callback: CallbackQuery):
     try:
-        if not RESTRICTED_USERS:
-            await callback.answer("Нет пользователей с ограниченным доступом", show_alert=True)
-            return
-
-        buttons = [
-            [InlineKeyboardButton(text=user_names.get(uid, str(uid)), callback_data=f"allow_{uid}")]
-            for uid in RESTRICTED_USERS
-        ]
-        await callback.message.edit_text(
-            "Выберите пользователя для восстановления доступа:",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
-        )
+        await show_picker(callback, "allow")
     except Exception as e:
         logger.error(f"Ошибка в allow_access_handler: {e}")
         await callback.answer("Ошибка обработки", show_alert=True)
 
-@dp.callback_query(F.data.startswith("allow_"))
-async def allow_user(callback: CallbackQuery):
+@callbacks.route("allow", "user_id", admin=True)
+async def allow_user(callback: CallbackQuery, user_id: str):
     try:
-        user_id = int(callback.data.split('_')[1])
+        user_id = int(user_id)
         if user_id in RESTRICTED_USERS:
             RESTRICTED_USERS.remove(user_id)
+            render_cache.bump_roster()
+            storage.set_role(user_id, "restricted", False)
+            storage.log_event(callback.from_user.id, "allow", user_id)
+            render_cache.bump(user_id)
             await callback.message.edit_text(
                 f"✅ Пользователь {user_names.get(user_id, user_id)} теперь имеет доступ"
             )
-            try:
-                await bot.send_message(user_id, "✅ Ваш доступ к боту был восстановлен администратором")
-            except:
-                logger.warning(f"Не удалось уведомить пользователя {user_id}")
+            outbound.notify(user_id, "✅ Ваш доступ к боту был восстановлен администратором")
         else:
             await callback.answer("Пользователь не был ограничен", show_alert=True)
         await callback.answer()
@@ -479,7 +1514,7 @@ async def allow_user(callback: CallbackQuery):
         logger.error(f"Ошибка в allow_user: {e}")
         await callback.answer("Ошибка операции", show_alert=True)
 
-@dp.callback_query(F.data == "list_users")
+@callbacks.route("list_users", admin=True)
 async def list_users_handler(callback: CallbackQuery):
     try:
         user_list = []
@@ -495,87 +1530,61 @@ async def list_users_handler(callback: CallbackQuery):
         logger.error(f"Ошибка в list_users_handler: {e}")
         await callback.answer("Ошибка загрузки списка", show_alert=True)
 
-@dp.callback_query(F.data == "make_admin")
+@callbacks.route("make_admin", admin=True)
 async def make_admin_handler(callback: CallbackQuery):
     try:
-        candidates = [
-            [InlineKeyboardButton(text=user_names.get(uid, str(uid)), callback_data=f"make_admin_{uid}")]
-            for uid in user_names if uid not in ADMINS
-        ]
-
-        if not candidates:
-            await callback.answer("Все пользователи уже являются администраторами", show_alert=True)
-            return
-
-        await callback.message.edit_text(
-            "Выберите пользователя для назначения администратором:",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=candidates)
-        )
+        await show_picker(callback, "grant")
     except Exception as e:
         logger.error(f"Ошибка в make_admin_handler: {e}")
         await callback.answer("Ошибка обработки", show_alert=True)
 
-@dp.callback_query(F.data.startswith("make_admin_"))
-async def make_admin(callback: CallbackQuery):
+@callbacks.route("grant_admin", "user_id", admin=True)
+async def make_admin(callback: CallbackQuery, user_id: str):
     try:
-        user_id = int(callback.data.split('_')[2])
+        user_id = int(user_id)
         if user_id in ADMINS:
             await callback.answer("Пользователь уже администратор", show_alert=True)
             return
 
         ADMINS.add(user_id)
-        # TODO: сохранить ADMINS на диск при необходимости
+        storage.set_role(user_id, "admin", True)
+        storage.log_event(callback.from_user.id, "grant_admin", user_id)
+        render_cache.bump_roster()
 
         await callback.message.edit_text(
             f"✅ Пользователь {user_names.get(user_id, str(user_id))} назначен администратором"
         )
-        try:
-            await bot.send_message(user_id, "👑 Вы были назначены администратором бота")
-        except Exception:
-            logger.warning(f"Не удалось уведомить пользователя {user_id}")
+        outbound.notify(user_id, "👑 Вы были назначены администратором бота")
         await callback.answer()
     except Exception as e:
         logger.error(f"Ошибка в make_admin: {e}")
         await callback.answer("Ошибка операции", show_alert=True)
 
-@dp.callback_query(F.data == "remove_admin")
+@callbacks.route("remove_admin", admin=True)
 async def remove_admin_handler(callback: CallbackQuery):
     try:
-        candidates = [
-            [InlineKeyboardButton(text=user_names.get(uid, str(uid)), callback_data=f"remove_admin_{uid}")]
-            for uid in ADMINS if uid != callback.from_user.id
-        ]
-
-        if not candidates:
-            await callback.answer("Нет других администраторов для снятия", show_alert=True)
-            return
-
-        await callback.message.edit_text(
-            "Выберите администратора для снятия прав:",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=candidates)
-        )
+        await show_picker(callback, "revoke")
     except Exception as e:
         logger.error(f"Ошибка в remove_admin_handler: {e}")
         await callback.answer("Ошибка обработки", show_alert=True)
 
-@dp.callback_query(F.data.startswith("remove_admin_"))
-async def remove_admin(callback: CallbackQuery):
+@callbacks.route("revoke_admin", "user_id", admin=True)
+async def remove_admin(callback: CallbackQuery, user_id: str):
     try:
-        user_id = int(callback.data.split('_')[2])
+        user_id = int(user_id)
         if user_id not in ADMINS:
             await callback.answer("Пользователь не является администратором", show_alert=True)
             return
 
         ADMINS.remove(user_id)
-        # TODO: сохранить ADMINS на диск при необходимости
+        storage.set_role(user_id, "admin", False)
+        storage.log_event(callback.from_user.id, "revoke_admin", user_id)
+        render_cache.bump_roster()
 
         await callback.message.edit_text(
             f"❌ Пользователь {user_names.get(user_id, str(user_id))} лишён прав администратора"
         )
-        try:
-            await bot.send_message(user_id, "⚠️ Ваши права администратора были сняты")
-        except Exception:
-            logger.warning(f"Не удалось уведомить пользователя {user_id}")
+        outbound.notify(user_id, "⚠️ Ваши права администратора были сняты")
         await callback.answer()
     except Exception as e:
         logger.error(f"Ошибка в remove_admin: {e}")
@@ -584,34 +1593,261 @@ async def remove_admin(callback: CallbackQuery):
 async def handle(request):
     return web.Response(text="✅ Бот работает!")
 
-async def run_web():
-    app = web.Application()
-    app.router.add_get("/", handle)
+@web.middleware
+async def reject_when_stopping(request: web.Request, handler):
+    # Telegram повторит доставку, и обновление обработает следующий экземпляр
+    if not in_flight.accepting and request.path == WEBHOOK_PATH:
+        raise web.HTTPServiceUnavailable()
+    return await handler(request)
+
+async def handle_healthz(request):
+    report = health_monitor.report
+    return web.json_response(report, status=200 if report["live"] else 503)
+
+async def handle_readyz(request):
+    report = health_monitor.report
+    return web.json_response(report, status=200 if report["ready"] else 503)
+
+async def watch_webhook(interval: float = 30.0):
+    # В режиме webhook getUpdates не вызывается: о живости судим по getWebhookInfo
+    last_error_date = None
+    while True:
+        try:
+            info = await bot.get_webhook_info()
+            webhook_state["pending"] = info.pending_update_count
+            if info.last_error_date is None or info.last_error_date == last_error_date:
+                health_monitor.beat("updates")
+            else:
+                logger.warning(f"Ошибка доставки webhook: {info.last_error_message}")
+            last_error_date = info.last_error_date
+        except Exception as e:
+            logger.warning(f"Не удалось получить состояние webhook: {e}")
+        await asyncio.sleep(interval)
+
+async def handle_metrics(request):
+    return web.Response(
+        body=REGISTRY.render().encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+    )
+
+async def handle_export(request: web.Request) -> web.StreamResponse:
+    authorization = request.headers.get("Authorization", "")
+    if not secrets.compare_digest(authorization.encode(), f"Bearer {EXPORT_TOKEN}".encode()):
+        raise web.HTTPUnauthorized()
+    try:
+        start = date.fromisoformat(request.query.get("start", ""))
+        end = date.fromisoformat(request.query.get("end", ""))
+    except ValueError:
+        raise web.HTTPBadRequest(text="start и end в формате ГГГГ-ММ-ДД")
+    if end < start or (end - start).days >= EXPORT_MAX_DAYS:
+        raise web.HTTPBadRequest(text=f"Период от 1 до {EXPORT_MAX_DAYS} дней")
+    as_xlsx = request.query.get("format", "csv") == "xlsx"
+    if as_xlsx and not export.xlsx_available():
+        raise web.HTTPNotImplemented(text="openpyxl не установлен")
+
+    past_statuses, past_comments = await load_export_history(start, end)
+    rows = export_rows(start, end, past_statuses, past_comments)
+    filename = f"schedule_{start.isoformat()}_{end.isoformat()}.{'xlsx' if as_xlsx else 'csv'}"
+    response = web.StreamResponse(headers={
+        "Content-Type": (
+            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet" if as_xlsx
+            else "text/csv; charset=utf-8"
+        ),
+        "Content-Disposition": f'attachment; filename="{filename}"',
+    })
+    await response.prepare(request)
+    if as_xlsx:
+        await response.write(await asyncio.to_thread(export.write_xlsx, await collect_rows(rows)))
+    else:
+        # CSV уходит клиенту по мере формирования
+        for chunk in export.csv_chunks(rows):
+            await response.write(chunk)
+    await response.write_eof()
+    return response
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in tags or etag in tags
+
+def calendar_response(request: web.Request, etag: str, render) -> web.Response:
+    # Клиенты опрашивают ленту часто: совпавший ETag отвечает 304 без отрисовки
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=300"}
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=render(), content_type="text/calendar", charset="utf-8", headers=headers)
+
+async def handle_user_calendar(request: web.Request) -> web.Response:
+    user_id = int(request.match_info["user_id"])
+    if not secrets.compare_digest(request.match_info["token"], feed_token(f"user:{user_id}")):
+        raise web.HTTPNotFound()
+    if user_id not in user_names or user_id in RESTRICTED_USERS:
+        raise web.HTTPNotFound()
+    today = datetime.now().date()
+    version = render_cache.user_version(user_id)
+    etag = f'"u{user_id}-{version}-{today:%Y%m%d}-{BOOT_ID}"'
+    key = ("ical", user_id, today, version)
+    return calendar_response(request, etag, lambda: render_cache.get_or_render(key, lambda: render_user_feed(user_id, today)))
+
+async def handle_team_calendar(request: web.Request) -> web.Response:
+    if not secrets.compare_digest(request.match_info["token"], feed_token("team")):
+        raise web.HTTPNotFound()
+    today = datetime.now().date()
+    version = render_cache.version
+    etag = f'"t{version}-{today:%Y%m%d}-{BOOT_ID}"'
+    key = ("ical_team", today, version)
+    return calendar_response(request, etag, lambda: render_cache.get_or_render(key, lambda: render_team_feed(today)))
 
-    runner = web.AppRunner(app)
+def create_web_app(use_webhook: bool) -> web.Application:
+    app = web.Application(middlewares=[reject_when_stopping] if use_webhook else [])
+    app.router.add_get("/", handle)
+    app.router.add_get("/metrics", handle_metrics)
+    app.router.add_get("/healthz", handle_healthz)
+    app.router.add_get("/readyz", handle_readyz)
+    if EXPORT_TOKEN:
+        app.router.add_get("/export", handle_export)
+    if ICAL_SECRET:
+        app.router.add_get("/ical/team/{token}.ics", handle_team_calendar)
+        app.router.add_get(r"/ical/{user_id:\d+}/{token}.ics", handle_user_calendar)
+    if use_webhook:
+        # Обновления от Telegram сразу передаются в диспетчер
+        SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    return app
+
+async def run_web(app: web.Application) -> web.AppRunner:
+    runner = web.AppRunner(app, shutdown_timeout=5.0)
     await runner.setup()
-    site = web.TCPSite(runner, "0.0.0.0", 8080)
+    site = web.TCPSite(runner, "0.0.0.0", WEB_PORT)
     await site.start()
-    logger.info("Веб-сервер запущен на порту 8080")
+    logger.info(f"Веб-сервер запущен на порту {WEB_PORT}")
+    return runner
 
-async def clear_comments_daily():
+async def setup_webhook() -> bool:
+    if not WEBHOOK_URL:
+        return False
+    try:
+        await bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        logger.info(f"Webhook установлен: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+        return True
+    except Exception as e:
+        logger.error(f"Не удалось установить webhook, переключаемся на polling: {e}")
+        return False
+
+def expire_past_days(today: date):
+    index = day_index(today)
+    # Из памяти уходят только корзины прошедших дней
+    for expired, users in comment_expiry.pop_before(index):
+        date_str = day_date(expired).isoformat()
+        for user_id in users:
+            comments = user_comments.get(user_id)
+            if comments is not None and comments.pop(date_str, None) is not None:
+                render_cache.bump(user_id)
+                if not comments:
+                    del user_comments[user_id]
+    schedules.drop_before(index)
+    # В базе прошлые дни хранятся RETENTION_DAYS, затем удаляются или уходят в архив
+    storage.expire_before((today - timedelta(days=RETENTION_DAYS)).isoformat())
+    storage.compact_events((today - timedelta(days=AUDIT_RETENTION_DAYS)).isoformat())
+
+async def expire_daily():
     while True:
         now = datetime.now()
         next_midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
-        seconds_until_midnight = (next_midnight - now).total_seconds()
-        await asyncio.sleep(seconds_until_midnight)
-        user_comments.clear()
-        logger.info("Комментарии очищены после окончания дня.")
+        await asyncio.sleep((next_midnight - now).total_seconds())
+        expire_past_days(next_midnight.date())
+        logger.info(f"Данные за прошедшие дни убраны, комментариев осталось: {len(comment_expiry)}")
+
+async def load_state():
+    snapshot = await storage.load_async()
+    user_names.update(snapshot.user_names)
+    name_index.rebuild(user_names)
+    schedules.load(snapshot.work_modes, snapshot.templates)
+    user_comments.update(snapshot.comments)
+    for user_id, comments in user_comments.items():
+        for date_str in comments:
+            comment_expiry.add(day_index(date.fromisoformat(date_str)), user_id)
+    expire_past_days(datetime.now().date())
+    # Админы из .env остаются админами всегда, назначенные в боте — добавляются к ним
+    ADMINS.update(snapshot.admins)
+    RESTRICTED_USERS.update(snapshot.restricted)
+    fsm_storage.load(snapshot.fsm)
+
+async def shutdown(runner: web.AppRunner, services: list):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + SHUTDOWN_TIMEOUT
+
+    def remaining() -> float:
+        return max(0.0, deadline - loop.time())
+
+    logger.info("Остановка: новые обновления не принимаются")
+    health_monitor.set_draining()
+    in_flight.accepting = False
+    with suppress(RuntimeError):  # polling не запускался или уже остановлен
+        await dp.stop_polling()
+    if not await in_flight.wait_idle(remaining()):
+        logger.warning(f"Не дождались обработки {in_flight.in_flight} обновлений")
+
+    for task in services:
+        task.cancel()
+    await asyncio.gather(*services, return_exceptions=True)
+
+    # Правки клавиатур ставят запросы в общую очередь, поэтому сначала они
+    if not await edits.drain(remaining()):
+        logger.warning(f"Не отправлены правки клавиатур: {edits.in_flight}")
+    if not await outbound.drain(remaining()):
+        logger.warning(f"Не отправлены уведомления: {outbound.queue_depth}")
+
+    await runner.cleanup()
+    await outbound.close()
+    await storage.close()
+    await bot.session.close()
+    logger.info("Бот остановлен")
 
 async def main():
-    # Отключаем webhook чтобы избежать конфликтов с polling
-    await bot.delete_webhook(drop_pending_updates=True)
-
-    await asyncio.gather(
-        dp.start_polling(bot),
-        run_web(),
-        clear_comments_daily()
-    )
+    await load_state()
+    storage.start()
+    outbound.start()
+
+    use_webhook = await setup_webhook()
+    runner = await run_web(create_web_app(use_webhook))
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        with suppress(NotImplementedError):  # на Windows сигналы не поддерживаются
+            loop.add_signal_handler(sig, stop.set)
+
+    services = [expire_daily(), digest_daily(), watch_event_loop(), health_monitor.run()]
+    if use_webhook:
+        services.append(watch_webhook())
+    else:
+        # Отключаем webhook чтобы избежать конфликтов с polling. Накопившиеся
+        # за время перезапуска обновления не сбрасываем — их обработаем сейчас
+        await bot.delete_webhook(drop_pending_updates=False)
+        # Сигналы и сессию бота обрабатываем сами: сессия нужна до конца отправки очереди
+        services.append(dp.start_polling(bot, handle_signals=False, close_bot_session=False))
+    services = [asyncio.create_task(service) for service in services]
+
+    def on_service_done(task: asyncio.Task):
+        # Служба может штатно завершиться сама (например, отключённая сводка),
+        # останавливаемся только при ошибке
+        if not task.cancelled() and task.exception() is not None:
+            stop.set()
+
+    for task in services:
+        task.add_done_callback(on_service_done)
+    try:
+        await stop.wait()
+    finally:
+        await shutdown(runner, services)
+    for task in services:
+        if not task.cancelled() and task.exception() is not None:
+            raise task.exception()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,267 @@
+import asyncio
+import logging
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramBadRequest, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import InlineKeyboardMarkup
+
+from metrics import OUTBOUND_FAILED, OUTBOUND_RETRIED, OUTBOUND_SENT
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BULK = 1
+LANE_NAMES = ("interactive", "bulk")
+
+# Полоса текущего запроса: ответы в обработчиках — interactive,
+# рассылки из очереди уведомлений — bulk
+current_lane: ContextVar[int] = ContextVar("outbound_lane", default=INTERACTIVE)
+
+# Служебные методы, на которые лимиты отправки сообщений не распространяются
+UNTHROTTLED_METHODS = {"getUpdates", "getMe", "setWebhook", "deleteWebhook", "getWebhookInfo"}
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, now: float) -> float:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def reserve(self, now: float) -> float:
+        """Забирает токен (возможно, в долг) и возвращает, сколько нужно подождать."""
+        self.refill(now)
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+
+class OutboundDispatcher(BaseRequestMiddleware):
+    """Единая точка исходящих запросов к Bot API.
+
+    Подключается как middleware сессии бота, поэтому через неё проходят все
+    вызовы: общий token bucket и bucket на каждый чат, повтор при
+    TelegramRetryAfter. Массовые уведомления идут через ограниченную очередь
+    и получают токены только при запасе, оставляя его интерактивным ответам.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        global_rate: float = 30.0,
+        chat_rate: float = 1.0,
+        chat_burst: float = 3.0,
+        queue_size: int = 1000,
+        workers: int = 4,
+        max_retries: int = 3,
+        bulk_headroom: float = 0.2,
+        max_chat_buckets: int = 10000,
+    ):
+        self.bot = bot
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.workers = workers
+        self.max_retries = max_retries
+        self.max_chat_buckets = max_chat_buckets
+        self._bulk_reserve = global_rate * bulk_headroom
+        self._global: Optional[TokenBucket] = None
+        self._chats: Dict[Hashable, TokenBucket] = {}
+        self._paused_until = 0.0
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._tasks: List[asyncio.Task] = []
+
+        self.dropped = 0
+
+    # --- middleware сессии ---
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if method.__api_method__ in UNTHROTTLED_METHODS:
+            return await make_request(bot, method)
+
+        lane = current_lane.get()
+        lane_name = LANE_NAMES[lane]
+        attempt = 0
+        while True:
+            await self._acquire(getattr(method, "chat_id", None), lane)
+            try:
+                result = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                attempt += 1
+                OUTBOUND_RETRIED.inc(lane_name)
+                # 429 от Telegram означает общий флуд-контроль: притормаживаем все запросы
+                self._pause(e.retry_after)
+                logger.warning(f"{method.__api_method__}: флуд-контроль, повтор через {e.retry_after} с")
+                if attempt > self.max_retries:
+                    OUTBOUND_FAILED.inc(lane_name)
+                    raise
+            except (TelegramNetworkError, TelegramServerError) as e:
+                attempt += 1
+                OUTBOUND_RETRIED.inc(lane_name)
+                if attempt > self.max_retries:
+                    OUTBOUND_FAILED.inc(lane_name)
+                    raise
+                logger.warning(f"{method.__api_method__}: {e}, повтор #{attempt}")
+                await asyncio.sleep(min(0.5 * 2 ** attempt, 10.0))
+            except Exception:
+                OUTBOUND_FAILED.inc(lane_name)
+                raise
+            else:
+                OUTBOUND_SENT.inc(lane_name)
+                return result
+
+    def _pause(self, seconds: float):
+        loop = asyncio.get_running_loop()
+        self._paused_until = max(self._paused_until, loop.time() + seconds)
+
+    async def _acquire(self, chat_id: Any, lane: int):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        delay = self._paused_until - now
+        if chat_id is not None:
+            bucket = self._chats.get(chat_id)
+            if bucket is None:
+                if len(self._chats) >= self.max_chat_buckets:
+                    self._evict_idle_chats(now)
+                bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+            delay = max(delay, bucket.reserve(now))
+        if delay > 0:
+            await asyncio.sleep(delay)
+            now = loop.time()
+
+        if self._global is None:
+            self._global = TokenBucket(self.global_rate, self.global_rate, now)
+        if lane == BULK:
+            # Рассылка ждёт, пока в общем bucket не останется запас для интерактивных ответов
+            while self._global.refill(now) < self._bulk_reserve + 1:
+                await asyncio.sleep(1 / self.global_rate)
+                now = loop.time()
+        delay = self._global.reserve(now)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _evict_idle_chats(self, now: float):
+        # Полностью восстановившиеся bucket'ы ничем не отличаются от новых
+        idle = [chat_id for chat_id, bucket in self._chats.items() if bucket.refill(now) >= bucket.capacity]
+        for chat_id in idle:
+            del self._chats[chat_id]
+
+    # --- очередь уведомлений ---
+
+    def notify(self, chat_id: int, text: str, **kwargs) -> bool:
+        """Ставит уведомление в очередь, не дожидаясь отправки."""
+        try:
+            self._queue.put_nowait((chat_id, text, kwargs))
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning(f"Очередь уведомлений переполнена, сообщение для {chat_id} отброшено")
+            return False
+
+    def start(self):
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    async def _worker(self):
+        current_lane.set(BULK)
+        while True:
+            chat_id, text, kwargs = await self._queue.get()
+            try:
+                await self.bot.send_message(chat_id, text, **kwargs)
+            except Exception as e:
+                logger.warning(f"Не удалось уведомить пользователя {chat_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def drain(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def queue_size(self) -> int:
+        return self._queue.maxsize
+
+
+class EditCoalescer:
+    """Схлопывает частые правки клавиатуры одного сообщения.
+
+    Изменения применяются сразу, а в Telegram после короткой паузы уходит
+    только последняя версия клавиатуры. На каждое сообщение в полёте не
+    больше одного запроса.
+    """
+
+    def __init__(self, bot: Bot, delay: float = 0.3):
+        self.bot = bot
+        self.delay = delay
+        self._pending: Dict[Tuple[int, int], Callable[[], InlineKeyboardMarkup]] = {}
+        self._tasks: Dict[Tuple[int, int], asyncio.Task] = {}
+        self.requested = 0
+        self.pushed = 0
+
+    def schedule(self, chat_id: int, message_id: int, render: Callable[[], InlineKeyboardMarkup]):
+        key = (chat_id, message_id)
+        self.requested += 1
+        self._pending[key] = render
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._run(key))
+
+    async def _run(self, key: Tuple[int, int]):
+        chat_id, message_id = key
+        try:
+            while key in self._pending:
+                await asyncio.sleep(self.delay)
+                render = self._pending.pop(key)
+                try:
+                    markup = render()
+                    await self.bot.edit_message_reply_markup(
+                        chat_id=chat_id, message_id=message_id, reply_markup=markup
+                    )
+                    self.pushed += 1
+                except TelegramBadRequest as e:
+                    if "message is not modified" not in str(e):
+                        logger.warning(f"Не удалось обновить клавиатуру {key}: {e}")
+                except Exception as e:
+                    logger.warning(f"Не удалось обновить клавиатуру {key}: {e}")
+        finally:
+            del self._tasks[key]
+
+    async def drain(self, timeout: float) -> bool:
+        if not self._tasks:
+            return True
+        _, pending = await asyncio.wait(list(self._tasks.values()), timeout=timeout)
+        return not pending
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
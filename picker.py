@@ -0,0 +1,88 @@
+from bisect import bisect_left, insort
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.lower().replace("ё", "е").split())
+
+
+class NameIndex:
+    """Префиксный индекс по словам имени: «ив» находит и «Иванов Пётр», и «Пётр Иванов»."""
+
+    def __init__(self):
+        self._entries: List[Tuple[str, int]] = []
+        self._tokens: Dict[int, List[str]] = {}
+
+    def set(self, user_id: int, name: str):
+        self.remove(user_id)
+        normalized = normalize(name)
+        tokens = sorted(set(normalized.split()) | {normalized})
+        for token in tokens:
+            insort(self._entries, (token, user_id))
+        self._tokens[user_id] = tokens
+
+    def remove(self, user_id: int):
+        for token in self._tokens.pop(user_id, ()):
+            position = bisect_left(self._entries, (token, user_id))
+            if position < len(self._entries) and self._entries[position] == (token, user_id):
+                del self._entries[position]
+
+    def rebuild(self, names: Dict[int, str]):
+        self._entries.clear()
+        self._tokens.clear()
+        for user_id, name in names.items():
+            normalized = normalize(name)
+            tokens = sorted(set(normalized.split()) | {normalized})
+            self._entries.extend((token, user_id) for token in tokens)
+            self._tokens[user_id] = tokens
+        self._entries.sort()
+
+    def search(self, query: str) -> List[int]:
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        found = []
+        seen = set()
+        position = bisect_left(self._entries, (prefix, -1 << 63))
+        while position < len(self._entries):
+            token, user_id = self._entries[position]
+            if not token.startswith(prefix):
+                break
+            if user_id not in seen:
+                seen.add(user_id)
+                found.append(user_id)
+            position += 1
+        return found
+
+
+def picker_keyboard(
+    items: Sequence[Tuple[int, str]],
+    page: int,
+    page_size: int,
+    item_data: Callable[[int], str],
+    page_data: Callable[[int], str],
+    counter_data: str,
+    extra_row: List[InlineKeyboardButton] = (),
+) -> Tuple[InlineKeyboardMarkup, int, int]:
+    """Клавиатура одной страницы списка: кнопки только для видимых элементов."""
+    pages = max(1, (len(items) + page_size - 1) // page_size)
+    page = max(0, min(page, pages - 1))
+    start = page * page_size
+    buttons = [
+        [InlineKeyboardButton(text=label, callback_data=item_data(user_id))]
+        for user_id, label in items[start:start + page_size]
+    ]
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton(text="◀️", callback_data=page_data(page - 1)))
+    if pages > 1:
+        nav.append(InlineKeyboardButton(text=f"{page + 1}/{pages}", callback_data=counter_data))
+    if page < pages - 1:
+        nav.append(InlineKeyboardButton(text="▶️", callback_data=page_data(page + 1)))
+    if nav:
+        buttons.append(nav)
+    if extra_row:
+        buttons.append(list(extra_row))
+    return InlineKeyboardMarkup(inline_keyboard=buttons), page, pages
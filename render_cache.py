@@ -0,0 +1,51 @@
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class RenderCache:
+    """LRU-кэш отрисованных клавиатур и текстов расписаний.
+
+    В ключ входит версия данных пользователя (или общая версия), поэтому
+    после изменения старые записи просто перестают находиться и со временем
+    вытесняются.
+    """
+
+    def __init__(self, maxsize: int = 2048):
+        self.maxsize = maxsize
+        self.version = 0
+        # Версия состава: имена, доступ и права админов, без расписаний
+        self.roster_version = 0
+        self.hits = 0
+        self.misses = 0
+        self._versions: Dict[int, int] = {}
+        self._entries: "OrderedDict[Hashable, object]" = OrderedDict()
+
+    def user_version(self, user_id: int) -> int:
+        return self._versions.get(user_id, 0)
+
+    def bump(self, user_id: int):
+        self._versions[user_id] = self._versions.get(user_id, 0) + 1
+        self.version += 1
+
+    def bump_roster(self):
+        self.roster_version += 1
+        self.version += 1
+
+    def get_or_render(self, key: Hashable, render: Callable[[], T]) -> T:
+        entries = self._entries
+        value = entries.get(key)
+        if value is not None:
+            entries.move_to_end(key)
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = render()
+        entries[key] = value
+        if len(entries) > self.maxsize:
+            entries.popitem(last=False)
+        return value
+
+    def __len__(self) -> int:
+        return len(self._entries)
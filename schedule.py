@@ -0,0 +1,226 @@
+from datetime import date, timedelta
+from heapq import heappop, heappush
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+# Коды статусов: 0 — явного значения нет, берётся значение по умолчанию
+STATUSES = ["Выходной", "Отпуск", "Офис", "Дистанционно", "Командировка", "Больничный"]
+STATUS_CODES = {name: code for code, name in enumerate(STATUSES, start=1)}
+NO_STATUS = 0
+WEEKEND = STATUS_CODES["Выходной"]
+OFFICE = STATUS_CODES["Офис"]
+
+EPOCH = date(2024, 1, 1)
+
+
+def day_index(day: date) -> int:
+    return (day - EPOCH).days
+
+
+def day_date(index: int) -> date:
+    return EPOCH + timedelta(days=index)
+
+
+def status_name(code: int) -> str:
+    return STATUSES[code - 1]
+
+
+def default_code(index: int) -> int:
+    # EPOCH — понедельник, поэтому день недели считается без datetime
+    return WEEKEND if index % 7 >= 5 else OFFICE
+
+
+class _UserDays:
+    """Явно заданные статусы одного пользователя: bytearray с кодами от дня base."""
+
+    __slots__ = ("base", "codes")
+
+    def __init__(self, base: int):
+        self.base = base
+        self.codes = bytearray()
+
+    def get(self, index: int) -> int:
+        offset = index - self.base
+        if 0 <= offset < len(self.codes):
+            return self.codes[offset]
+        return NO_STATUS
+
+    def set(self, index: int, code: int):
+        if not self.codes:
+            if code == NO_STATUS:
+                return
+            self.base = index
+        offset = index - self.base
+        if offset < 0:
+            if code == NO_STATUS:
+                return
+            self.codes[0:0] = bytes(-offset)
+            self.base = index
+            offset = 0
+        elif offset >= len(self.codes):
+            if code == NO_STATUS:
+                return
+            self.codes.extend(bytes(offset - len(self.codes) + 1))
+        self.codes[offset] = code
+        if code == NO_STATUS:
+            self._strip()
+
+    def drop_before(self, index: int):
+        offset = index - self.base
+        if offset > 0:
+            del self.codes[:offset]
+            self.base = index
+            self._strip()
+
+    def _strip(self):
+        end = len(self.codes)
+        while end and not self.codes[end - 1]:
+            end -= 1
+        del self.codes[end:]
+        start = 0
+        while start < len(self.codes) and not self.codes[start]:
+            start += 1
+        if start:
+            del self.codes[:start]
+            self.base += start
+
+
+class ScheduleStore:
+    """Расписания всех пользователей.
+
+    Хранятся только явные изменения и недельные шаблоны («дистанционно
+    каждую пятницу»), статус дня вычисляется при чтении: изменение, затем
+    шаблон, затем значение по умолчанию (будни — офис, выходные — выходной).
+    Дополнительно ведутся обратные индексы день -> статус -> пользователи
+    по явным изменениям и день недели -> статус -> пользователи по шаблонам.
+    """
+
+    def __init__(self):
+        self._users: Dict[int, _UserDays] = {}
+        self._by_day: Dict[int, Dict[int, Set[int]]] = {}
+        self._day_heap: List[int] = []
+        self._templates: Dict[int, bytearray] = {}
+        self._by_weekday: Dict[int, Dict[int, Set[int]]] = {}
+
+    def get(self, user_id: int, index: int) -> int:
+        days = self._users.get(user_id)
+        code = days.get(index) if days is not None else NO_STATUS
+        return code or self.base_code(user_id, index)
+
+    def base_code(self, user_id: int, index: int) -> int:
+        """Статус без учёта явного изменения: по шаблону или по умолчанию."""
+        template = self._templates.get(user_id)
+        code = template[index % 7] if template is not None else NO_STATUS
+        return code or default_code(index)
+
+    def status(self, user_id: int, day: date) -> str:
+        return status_name(self.get(user_id, day_index(day)))
+
+    def override(self, user_id: int, index: int) -> int:
+        days = self._users.get(user_id)
+        return days.get(index) if days is not None else NO_STATUS
+
+    def set(self, user_id: int, index: int, code: int) -> Optional[str]:
+        """Устанавливает статус и возвращает то, что нужно сохранить (None — удалить)."""
+        if code == self.base_code(user_id, index):
+            code = NO_STATUS
+        days = self._users.get(user_id)
+        if days is None:
+            if code == NO_STATUS:
+                return None
+            days = self._users[user_id] = _UserDays(index)
+        previous = days.get(index)
+        days.set(index, code)
+        if previous != code:
+            self._reindex(user_id, index, previous, code)
+        if not days.codes:
+            del self._users[user_id]
+        return status_name(code) if code else None
+
+    def set_range(self, user_id: int, start: int, end: int, code: int) -> Iterator[Tuple[int, Optional[str]]]:
+        """Статус на дни start..end включительно; отдаёт (день, что сохранить)."""
+        for index in range(start, end + 1):
+            yield index, self.set(user_id, index, code)
+
+    def template(self, user_id: int, weekday: int) -> int:
+        template = self._templates.get(user_id)
+        return template[weekday] if template is not None else NO_STATUS
+
+    def set_template(self, user_id: int, weekday: int, code: int) -> Optional[str]:
+        """Статус по шаблону на день недели (NO_STATUS — убрать), возвращает то, что сохранить."""
+        if code == default_code(weekday):
+            code = NO_STATUS
+        template = self._templates.get(user_id)
+        if template is None:
+            if code == NO_STATUS:
+                return None
+            template = self._templates[user_id] = bytearray(7)
+        previous = template[weekday]
+        template[weekday] = code
+        if previous != code:
+            self._reindex(user_id, weekday, previous, code, self._by_weekday)
+        if not any(template):
+            del self._templates[user_id]
+        return status_name(code) if code else None
+
+    def template_table(self) -> Dict[int, bytes]:
+        """Копия всех шаблонов: пользователь -> 7 кодов по дням недели."""
+        return {user_id: bytes(template) for user_id, template in self._templates.items()}
+
+    def weekday_templates(self, index: int) -> Dict[int, Set[int]]:
+        """Шаблоны, действующие в день index: код -> пользователи. Не изменять снаружи."""
+        return self._by_weekday.get(index % 7, {})
+
+    def _reindex(self, user_id: int, index: int, previous: int, code: int, by_index=None):
+        by_index = self._by_day if by_index is None else by_index
+        if previous:
+            buckets = by_index[index]
+            users = buckets[previous]
+            users.discard(user_id)
+            if not users:
+                del buckets[previous]
+                if not buckets:
+                    del by_index[index]
+        if code:
+            buckets = by_index.get(index)
+            if buckets is None:
+                buckets = by_index[index] = {}
+                if by_index is self._by_day:
+                    heappush(self._day_heap, index)
+            buckets.setdefault(code, set()).add(user_id)
+
+    def day_overrides(self, index: int) -> Dict[int, Set[int]]:
+        """Явные статусы на день: код -> пользователи. Не изменять снаружи."""
+        return self._by_day.get(index, {})
+
+    def drop_before(self, index: int):
+        # Обходятся только дни, ставшие прошлыми, и пользователи с изменениями в них
+        touched: Set[int] = set()
+        while self._day_heap and self._day_heap[0] < index:
+            for users in self._by_day.pop(heappop(self._day_heap), {}).values():
+                touched |= users
+        for user_id in touched:
+            days = self._users.get(user_id)
+            if days is None:
+                continue
+            days.drop_before(index)
+            if not days.codes:
+                del self._users[user_id]
+
+    def load(self, work_modes: Dict[int, Dict[str, str]], templates: Dict[int, Dict[int, str]] = None):
+        # Шаблоны первыми: явные изменения сравниваются со статусом по шаблону
+        for user_id, weekdays in (templates or {}).items():
+            for weekday, status in weekdays.items():
+                code = STATUS_CODES.get(status)
+                if code:
+                    self.set_template(user_id, weekday, code)
+        for user_id, days in work_modes.items():
+            for date_str, status in days.items():
+                code = STATUS_CODES.get(status)
+                if code:
+                    self.set(user_id, day_index(date.fromisoformat(date_str)), code)
+
+    def entry_count(self) -> int:
+        return sum(len(days.codes) for days in self._users.values())
+
+    def __len__(self) -> int:
+        return len(self._users)
@@ -0,0 +1,516 @@
+import asyncio
+import itertools
+import json
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+logger = logging.getLogger(__name__)
+
+# Ключ операции -> значение (None означает удаление строки).
+# Повторные изменения одного и того же ключа до сброса схлопываются в одну запись.
+OpKey = Tuple
+PendingOps = Dict[OpKey, object]
+
+
+@dataclass
+class Snapshot:
+    user_names: Dict[int, str] = field(default_factory=dict)
+    work_modes: Dict[int, Dict[str, str]] = field(default_factory=dict)
+    templates: Dict[int, Dict[int, str]] = field(default_factory=dict)
+    comments: Dict[int, Dict[str, str]] = field(default_factory=dict)
+    admins: Set[int] = field(default_factory=set)
+    restricted: Set[int] = field(default_factory=set)
+    fsm: Dict[str, Tuple[Optional[str], Dict[str, Any]]] = field(default_factory=dict)
+
+
+@dataclass
+class Event:
+    at: str  # локальное время в ISO-формате, до секунд
+    actor: int
+    action: str
+    target: int
+    data: Dict[str, Any] = field(default_factory=dict)
+
+
+class Storage:
+    """Хранилище с отложенной записью (write-behind).
+
+    Обработчики работают с данными в памяти, а изменения ставятся в очередь
+    и сбрасываются на диск пачкой в одной транзакции раз в flush_interval.
+    """
+
+    def __init__(self, flush_interval: float = 0.5):
+        self.flush_interval = flush_interval
+        self._pending: PendingOps = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage")
+        self._event_ids = itertools.count()
+        self._pending_since = 0.0
+        self.last_flush_at = time.monotonic()
+
+    # --- чтение ---
+
+    def load(self) -> Snapshot:
+        return Snapshot()
+
+    async def load_async(self) -> Snapshot:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.load)
+
+    def history(self, target: Optional[int], limit: int) -> List[Event]:
+        return []
+
+    def schedule_history(self, start: str, end: str) -> List[Tuple[int, str, str]]:
+        return []
+
+    async def schedule_history_async(self, start: str, end: str) -> List[Tuple[int, str, str]]:
+        """Явные статусы (user_id, day, status) за дни с start по end включительно."""
+        await self.flush()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.schedule_history, start, end)
+
+    def comment_history(self, start: str, end: str) -> List[Tuple[int, str, str]]:
+        return []
+
+    async def comment_history_async(self, start: str, end: str) -> List[Tuple[int, str, str]]:
+        """Комментарии (user_id, day, comment) за дни с start по end включительно."""
+        await self.flush()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.comment_history, start, end)
+
+    async def history_async(self, target: Optional[int] = None, limit: int = 20) -> List[Event]:
+        """Последние события журнала (по пользователю target или все), новые первыми."""
+        # Сначала дописываем накопленное, чтобы в выборку попали свежие изменения
+        await self.flush()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.history, target, limit)
+
+    # --- изменения (не блокируют event loop) ---
+
+    def set_name(self, user_id: int, name: str):
+        self._enqueue(("name", user_id), name)
+
+    def set_status(self, user_id: int, date_str: str, status: Optional[str]):
+        self._enqueue(("status", user_id, date_str), status)
+
+    def set_template(self, user_id: int, weekday: int, status: Optional[str]):
+        self._enqueue(("template", user_id, weekday), status)
+
+    def set_comment(self, user_id: int, date_str: str, comment: Optional[str]):
+        self._enqueue(("comment", user_id, date_str), comment)
+
+    def set_role(self, user_id: int, role: str, enabled: bool):
+        self._enqueue(("role", user_id, role), enabled)
+
+    def log_event(self, actor: int, action: str, target: int, **data):
+        """Добавить событие в журнал изменений. События не схлопываются."""
+        event = Event(datetime.now().isoformat(timespec="seconds"), actor, action, target, data)
+        self._enqueue(("event", next(self._event_ids)), event)
+
+    def compact_events(self, date_str: str):
+        """Удалить (или перенести в архив) события журнала раньше date_str."""
+        self._enqueue(("compact_events",), date_str)
+
+    def expire_before(self, date_str: str):
+        """Удалить (или перенести в архив) статусы и комментарии на дни раньше date_str."""
+        self._enqueue(("expire",), date_str)
+
+    def set_fsm(self, key: str, state: Optional[str], data: Dict[str, Any]):
+        value = (state, json.dumps(data, ensure_ascii=False)) if state or data else None
+        self._enqueue(("fsm", key), value)
+
+    def _enqueue(self, key: OpKey, value):
+        if not self._pending:
+            self._pending_since = time.monotonic()
+        # pop + вставка сохраняет порядок последнего изменения
+        self._pending.pop(key, None)
+        self._pending[key] = value
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    @property
+    def flush_lag(self) -> float:
+        """Сколько секунд изменения ждут записи (0, если ждать нечего)."""
+        return time.monotonic() - self._pending_since if self._pending else 0.0
+
+    # --- сброс на диск ---
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        if self._pending:
+            self._wakeup.set()
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await self._wakeup.wait()
+            # Даём накопиться пачке изменений: серия нажатий = одна транзакция
+            await asyncio.sleep(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка записи в хранилище: {e}")
+                await asyncio.sleep(self.flush_interval)
+                self._wakeup.set()
+
+    async def flush(self):
+        if not self._pending:
+            self.last_flush_at = time.monotonic()
+            return
+        batch, self._pending = self._pending, {}
+        batch_since = self._pending_since
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self._write_batch, batch)
+        except Exception:
+            # Возвращаем пачку в очередь, не затирая более свежие изменения
+            batch.update(self._pending)
+            self._pending = batch
+            self._pending_since = batch_since
+            raise
+        self.last_flush_at = time.monotonic()
+
+    def _write_batch(self, batch: PendingOps):
+        pass
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._close)
+        self._executor.shutdown(wait=True)
+
+    def _close(self):
+        pass
+
+
+class MemoryStorage(Storage):
+    """Ничего не сохраняет — для локального запуска и бенчмарков."""
+
+
+class SqliteStorage(Storage):
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            name    TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS schedule (
+            user_id INTEGER NOT NULL,
+            day     TEXT NOT NULL,
+            status  TEXT NOT NULL,
+            PRIMARY KEY (user_id, day)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS templates (
+            user_id INTEGER NOT NULL,
+            weekday INTEGER NOT NULL,
+            status  TEXT NOT NULL,
+            PRIMARY KEY (user_id, weekday)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS comments (
+            user_id INTEGER NOT NULL,
+            day     TEXT NOT NULL,
+            comment TEXT NOT NULL,
+            PRIMARY KEY (user_id, day)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS roles (
+            user_id INTEGER NOT NULL,
+            role    TEXT NOT NULL,
+            PRIMARY KEY (user_id, role)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS fsm (
+            key   TEXT PRIMARY KEY,
+            state TEXT,
+            data  TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS events (
+            seq    INTEGER PRIMARY KEY,
+            at     TEXT NOT NULL,
+            actor  INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            target INTEGER NOT NULL,
+            data   TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS events_target ON events (target, seq);
+        CREATE INDEX IF NOT EXISTS events_at ON events (at);
+        CREATE INDEX IF NOT EXISTS schedule_day ON schedule (day);
+        CREATE INDEX IF NOT EXISTS comments_day ON comments (day);
+    """
+    # Холодное хранилище для устаревших дней — отдельный файл
+    ARCHIVE_SCHEMA = """
+        CREATE TABLE IF NOT EXISTS archive.schedule (
+            user_id INTEGER NOT NULL,
+            day     TEXT NOT NULL,
+            status  TEXT NOT NULL,
+            PRIMARY KEY (user_id, day)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS archive.comments (
+            user_id INTEGER NOT NULL,
+            day     TEXT NOT NULL,
+            comment TEXT NOT NULL,
+            PRIMARY KEY (user_id, day)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS archive.events (
+            seq    INTEGER PRIMARY KEY,
+            at     TEXT NOT NULL,
+            actor  INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            target INTEGER NOT NULL,
+            data   TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path: str, flush_interval: float = 0.5, archive_path: str = ""):
+        super().__init__(flush_interval)
+        self.path = path
+        self.archive_path = archive_path
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            # Соединение используется только из потока self._executor
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.SCHEMA)
+            if self.archive_path:
+                conn.execute("ATTACH DATABASE ? AS archive", (self.archive_path,))
+                conn.executescript(self.ARCHIVE_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def load(self) -> Snapshot:
+        conn = self._connect()
+        snapshot = Snapshot()
+        for user_id, name in conn.execute("SELECT user_id, name FROM users"):
+            snapshot.user_names[user_id] = name
+        for user_id, day, status in conn.execute("SELECT user_id, day, status FROM schedule"):
+            snapshot.work_modes.setdefault(user_id, {})[day] = status
+        for user_id, weekday, status in conn.execute("SELECT user_id, weekday, status FROM templates"):
+            snapshot.templates.setdefault(user_id, {})[weekday] = status
+        for user_id, day, comment in conn.execute("SELECT user_id, day, comment FROM comments"):
+            snapshot.comments.setdefault(user_id, {})[day] = comment
+        for user_id, role in conn.execute("SELECT user_id, role FROM roles"):
+            if role == "admin":
+                snapshot.admins.add(user_id)
+            elif role == "restricted":
+                snapshot.restricted.add(user_id)
+        for key, state, data in conn.execute("SELECT key, state, data FROM fsm"):
+            snapshot.fsm[key] = (state, json.loads(data))
+        logger.info(
+            f"Загружено из {self.path}: пользователей {len(snapshot.user_names)}, "
+            f"расписаний {len(snapshot.work_modes)}, комментариев {len(snapshot.comments)}"
+        )
+        return snapshot
+
+    def _write_batch(self, batch: PendingOps):
+        conn = self._connect()
+        upserts: Dict[str, List[tuple]] = {}
+        deletes: Dict[str, List[tuple]] = {}
+        expire_before = None
+        compact_before = None
+        events: List[tuple] = []
+        for key, value in batch.items():
+            kind = key[0]
+            if kind == "event":
+                events.append((
+                    value.at, value.actor, value.action, value.target, json.dumps(value.data, ensure_ascii=False)
+                ))
+            elif kind == "expire":
+                expire_before = value
+            elif kind == "compact_events":
+                compact_before = value
+            elif kind == "name":
+                upserts.setdefault("users", []).append((key[1], value))
+            elif kind == "fsm":
+                if value is None:
+                    deletes.setdefault("fsm", []).append((key[1],))
+                else:
+                    upserts.setdefault("fsm", []).append((key[1], *value))
+            elif kind == "role":
+                target = upserts if value else deletes
+                target.setdefault("roles", []).append((key[1], key[2]))
+            elif value is None:
+                deletes.setdefault(kind, []).append((key[1], key[2]))
+            else:
+                upserts.setdefault(kind, []).append((key[1], key[2], value))
+
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO users (user_id, name) VALUES (?, ?)", upserts.get("users", [])
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO schedule (user_id, day, status) VALUES (?, ?, ?)",
+                upserts.get("status", [])
+            )
+            conn.executemany(
+                "DELETE FROM schedule WHERE user_id = ? AND day = ?", deletes.get("status", [])
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO templates (user_id, weekday, status) VALUES (?, ?, ?)",
+                upserts.get("template", [])
+            )
+            conn.executemany(
+                "DELETE FROM templates WHERE user_id = ? AND weekday = ?", deletes.get("template", [])
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO comments (user_id, day, comment) VALUES (?, ?, ?)",
+                upserts.get("comment", [])
+            )
+            conn.executemany(
+                "DELETE FROM comments WHERE user_id = ? AND day = ?", deletes.get("comment", [])
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO roles (user_id, role) VALUES (?, ?)", upserts.get("roles", [])
+            )
+            conn.executemany(
+                "DELETE FROM roles WHERE user_id = ? AND role = ?", deletes.get("roles", [])
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO fsm (key, state, data) VALUES (?, ?, ?)", upserts.get("fsm", [])
+            )
+            conn.executemany("DELETE FROM fsm WHERE key = ?", deletes.get("fsm", []))
+            # Журнал пишется в той же транзакции, что и изменения, которые он описывает
+            conn.executemany(
+                "INSERT INTO events (at, actor, action, target, data) VALUES (?, ?, ?, ?, ?)", events
+            )
+            if expire_before is not None:
+                self._expire(conn, expire_before)
+            if compact_before is not None:
+                self._compact_events(conn, compact_before)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if compact_before is not None:
+            # Переносим накопившийся WAL в основной файл, чтобы он не рос и не читался при старте
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def _expire(self, conn: sqlite3.Connection, date_str: str):
+        # Индексы по day: затрагиваются только устаревшие строки
+        for table in ("schedule", "comments"):
+            if self.archive_path:
+                conn.execute(
+                    f"INSERT OR REPLACE INTO archive.{table} SELECT * FROM main.{table} WHERE day < ?", (date_str,)
+                )
+            deleted = conn.execute(f"DELETE FROM main.{table} WHERE day < ?", (date_str,)).rowcount
+            if deleted:
+                logger.info(f"Удалено устаревших строк из {table}: {deleted}")
+
+    def _compact_events(self, conn: sqlite3.Connection, date_str: str):
+        if self.archive_path:
+            conn.execute("INSERT OR REPLACE INTO archive.events SELECT * FROM main.events WHERE at < ?", (date_str,))
+        deleted = conn.execute("DELETE FROM main.events WHERE at < ?", (date_str,)).rowcount
+        if deleted:
+            logger.info(f"Из журнала удалено старых событий: {deleted}")
+
+    def history(self, target: Optional[int], limit: int) -> List[Event]:
+        conn = self._connect()
+        if target is None:
+            rows = conn.execute(
+                "SELECT at, actor, action, target, data FROM events ORDER BY seq DESC LIMIT ?", (limit,)
+            )
+        else:
+            rows = conn.execute(
+                "SELECT at, actor, action, target, data FROM events WHERE target = ? ORDER BY seq DESC LIMIT ?",
+                (target, limit)
+            )
+        return [Event(at, actor, action, target, json.loads(data)) for at, actor, action, target, data in rows]
+
+    def _history(self, table: str, column: str, start: str, end: str) -> List[Tuple[int, str, str]]:
+        conn = self._connect()
+        query = f"SELECT user_id, day, {column} FROM main.{table} WHERE day BETWEEN ? AND ?"
+        params = (start, end)
+        if self.archive_path:
+            # Дни старше срока хранения лежат в архиве
+            query += f" UNION ALL SELECT user_id, day, {column} FROM archive.{table} WHERE day BETWEEN ? AND ?"
+            params += (start, end)
+        return conn.execute(query, params).fetchall()
+
+    def schedule_history(self, start: str, end: str) -> List[Tuple[int, str, str]]:
+        return self._history("schedule", "status", start, end)
+
+    def comment_history(self, start: str, end: str) -> List[Tuple[int, str, str]]:
+        return self._history("comments", "comment", start, end)
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class FSMStorage(BaseStorage):
+    """Хранилище состояний aiogram FSM: чтение из памяти, запись через Storage.
+
+    Благодаря этому незавершённый ввод имени или комментария переживает перезапуск.
+    """
+
+    def __init__(self, storage: Storage):
+        self.storage = storage
+        self._records: Dict[str, Tuple[Optional[str], Dict[str, Any]]] = {}
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+    def load(self, records: Dict[str, Tuple[Optional[str], Dict[str, Any]]]):
+        self._records.update(records)
+
+    def _save(self, key: str, state: Optional[str], data: Dict[str, Any]):
+        if state is None and not data:
+            self._records.pop(key, None)
+        else:
+            self._records[key] = (state, data)
+        self.storage.set_fsm(key, state, data)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        key = self._key(key)
+        state = state.state if hasattr(state, "state") else state
+        _, data = self._records.get(key, (None, {}))
+        self._save(key, state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return self._records.get(self._key(key), (None, {}))[0]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        key = self._key(key)
+        state, _ = self._records.get(key, (None, {}))
+        self._save(key, state, dict(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict(self._records.get(self._key(key), (None, {}))[1])
+
+    async def close(self) -> None:
+        pass
+
+    @property
+    def size(self) -> int:
+        # Не __len__: пустое хранилище не должно считаться ложным при передаче в Dispatcher
+        return len(self._records)
+
+
+def create_storage(backend: str, path: str, flush_interval: float = 0.5, archive_path: str = "") -> Storage:
+    if backend == "sqlite":
+        return SqliteStorage(path, flush_interval, archive_path)
+    if backend == "memory":
+        return MemoryStorage(flush_interval)
+    raise ValueError(f"Неизвестный тип хранилища: {backend}")